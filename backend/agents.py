@@ -1,147 +1,368 @@
-import operator
-from typing import Annotated, List, Union, TypedDict, Dict
+from typing import Annotated, List, Optional, Union, TypedDict, Dict
 from langchain_ollama import ChatOllama
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, RemoveMessage
 from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
 from langgraph.prebuilt import create_react_agent
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langgraph.prebuilt.chat_agent_executor import AgentState as ReactAgentState
 import asyncio
+import json
 import os
+import uuid
 from dotenv import load_dotenv
+from mcp_pool import tool_pool
+from embedding_service import embedding_service
+from intents import FAST_PATH_ENABLED, FAST_PATH_THRESHOLD, classify_intent
+from memory import CONTEXT_STRATEGY, SUMMARY_TAG, fold_point, get_checkpointer, summary_prompt, thread_id_for
+from telemetry import stage, telemetry_callback
+from semantic_cache import SEMANTIC_CACHE_ENABLED, advisory_cache, is_cacheable_query, policy_corpus_version
 
 load_dotenv()
 
+# ollama, or fake for offline load tests (deterministic tool calls, see benchmarks/fakes.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama")
+
+def chat_model():
+    if LLM_BACKEND == "fake":
+        from benchmarks.fakes import FakeChatModel
+        return FakeChatModel()
+    return ChatOllama(
+        model=os.getenv("MODEL_NAME", "llama3.2"),
+        base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+        temperature=0
+    )
+
 # Initialize LLM
-llm = ChatOllama(
-    model=os.getenv("MODEL_NAME", "llama3.2"),
-    base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
-    temperature=0
-)
+llm = chat_model()
+
+# Tool outputs in streamed progress events are truncated to keep the stream light
+TOOL_EVENT_MAX_CHARS = 500
 
 # State definition
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
+    # add_messages merges by message id, so a checkpointed thread grows by the new turn only
+    messages: Annotated[List[BaseMessage], add_messages]
     customer_info: Dict
     auth_status: bool
+    summary: str # Running summary of turns folded out of the context window (see compact_node)
+
+# State of the specialist ReAct agents: carries customer_info so their prompts can include it
+class SpecialistState(ReactAgentState):
+    customer_info: Dict
+    auth_status: bool
+    summary: str
+
+def with_customer_context(instructions: str):
+    """Prompt that appends the authenticated customer's identity, so tools get customer_id without an email lookup."""
+    def prompt(state: SpecialistState):
+        info = state.get("customer_info") or {}
+        system = instructions
+        if info.get("id"):
+            system += (f"\n        Authenticated customer: customer_id={info['id']}, name={info.get('name')}, email={info.get('email')}."
+                       "\n        Pass this customer_id to tools that take one; never ask the user for it.")
+        if state.get("summary"):
+            system += f"\n        Summary of the earlier conversation: {state['summary']}"
+        return [SystemMessage(content=system)] + list(state["messages"])
+    return prompt
 
 # Initialize tools globally or on demand
 _tools = []
+_tools_lock = asyncio.Lock()
 
 async def get_tools_cached():
     global _tools
-    if not _tools:
-        client = MultiServerMCPClient({
-            "banking": {
-                "command": "python",
-                "args": ["/Users/lakshmishashankch/Development/IVA/backend/mcp_server.py"],
-                "transport": "stdio"
-            }
-        })
-        _tools = await client.get_tools()
+    if _tools:
+        return _tools
+    async with _tools_lock:
+        if not _tools:
+            # Tools dispatch over a pool of persistent MCP sessions (see mcp_pool.py)
+            await tool_pool.start()
+            _tools = tool_pool.tools()
     return _tools
 
 # Define Specialized Agents
-async def get_onboarding_agent():
-    tools = await get_tools_cached()
+def build_onboarding_agent(tools):
     return create_react_agent(
         model=llm,
         tools=[t for t in tools if t.name in ["get_customer_profile", "apply_for_product"]],
-        prompt="""You are an Onboarding Specialist. Help NEW customers with:
+        state_schema=SpecialistState,
+        prompt=with_customer_context("""You are an Onboarding Specialist. Help NEW customers with:
         1. Account Opening
         2. Loan Applications
         3. Credit Card Applications
         Always check if the customer already exists using 'get_customer_profile' if they provide an email.
         Then use 'apply_for_product' to submit their application.
-        IMPORTANT: Provide tool arguments as plain strings or numbers, never as dictionaries with type info."""
+        IMPORTANT: Provide tool arguments as plain strings or numbers, never as dictionaries with type info.""")
     )
 
-async def get_banking_agent():
-    tools = await get_tools_cached()
+def build_banking_agent(tools):
     return create_react_agent(
         model=llm,
-        tools=[t for t in tools if t.name in ["get_account_balance", "transfer_funds", "update_customer_address", "validate_transaction_fraud"]],
-        prompt="""You are a Banking Assistant for AUTHENTICATED users. 
-        You can check balances, transfer funds, and update addresses.
-        Use the user's email from the context to pull all associated accounts if needed.
-        CRITICAL: For transfers > $5000, ALWAYS call 'validate_transaction_fraud' before confirming.
-        IMPORTANT: Provide tool arguments as plain strings or numbers, never as dictionaries with type info."""
+        tools=[t for t in tools if t.name in ["get_account_balance", "get_transaction_history", "transfer_funds", "update_customer_address", "validate_transaction_fraud"]],
+        state_schema=SpecialistState,
+        prompt=with_customer_context("""You are a Banking Assistant for AUTHENTICATED users. 
+        You can check balances, show recent transactions, transfer funds, and update addresses.
+        Use the customer_id from the context to pull all associated accounts if needed.
+        CRITICAL: For transfers > $5000 or to a new payee, ALWAYS call 'validate_transaction_fraud' (with the account_number and counterparty_account) before confirming.
+        If a transfer result says it was flagged for review, tell the customer a confirmation email was sent.
+        When you need several independent lookups (e.g. balances and recent transactions, or the fraud check and the account details),
+        request all of those tool calls in the same step: they run in parallel. Request transfers and address updates on their own.
+        IMPORTANT: Provide tool arguments as plain strings or numbers, never as dictionaries with type info.""")
     )
 
-async def get_advisory_agent():
-    tools = await get_tools_cached()
+def build_advisory_agent(tools):
     return create_react_agent(
         model=llm,
         tools=[t for t in tools if t.name in ["query_policy_rag"]],
-        prompt="""You are a Financial Advisor and Policy Expert.
+        state_schema=SpecialistState,
+        prompt=with_customer_context("""You are a Financial Advisor and Policy Expert.
         Use 'query_policy_rag' to answer questions about bank policies like ACH or cheque clearing.
         IMPORTANT: Provide 'search_query' as a plain text string ONLY. Do not use dictionaries or type definitions.
-        Provide personalized investment or credit card suggestions based on user interests."""
+        Provide personalized investment or credit card suggestions based on user interests.""")
     )
 
+# Agent registry: each agent is compiled once (at startup or on first use) and reused by every request
+AGENT_BUILDERS = {
+    "onboarding": build_onboarding_agent,
+    "banking": build_banking_agent,
+    "advisory": build_advisory_agent,
+}
+_agents = {}
+_agents_lock = asyncio.Lock()
+
+async def get_agent(name: str):
+    agent = _agents.get(name)
+    if agent is None:
+        async with _agents_lock:
+            agent = _agents.get(name)
+            if agent is None:
+                tools = await get_tools_cached()
+                agent = AGENT_BUILDERS[name](tools)
+                _agents[name] = agent
+    return agent
+
+async def warm_agents():
+    """Loads the MCP tools and compiles every specialist agent ahead of the first request."""
+    await get_tools_cached()
+    for name in AGENT_BUILDERS:
+        await get_agent(name)
+
 # Routing Logic
 def router(state: AgentState):
+    with stage("router"):
+        return choose_route(state)
+
+def choose_route(state: AgentState):
     messages = state["messages"]
     last_message = messages[-1].content.lower()
     
     if not state["auth_status"]:
         return "onboarding"
     
+    # High-confidence read-only intents are answered without the LLM
+    if FAST_PATH_ENABLED and state["customer_info"].get("id"):
+        intent = classify_intent(messages[-1].content)
+        if intent.name == "check_balance" and intent.confidence >= FAST_PATH_THRESHOLD:
+            return "fast_path"
+    
     if any(word in last_message for word in ["policy", "clearing", "ach", "cheque", "suggest", "investment"]):
         return "advisory"
     
     return "banking"
 
+# Context window management: runs before routing on every turn
+summarizer = llm.with_config(tags=[SUMMARY_TAG])
+
+async def compact_node(state: AgentState):
+    messages = state["messages"]
+    cut = fold_point(messages)
+    if not cut:
+        return {}
+    update = {"messages": [RemoveMessage(id=m.id) for m in messages[:cut]]}
+    if CONTEXT_STRATEGY == "summarize":
+        try:
+            result = await summarizer.ainvoke([HumanMessage(content=summary_prompt(state.get("summary", ""), messages[:cut]))])
+            update["summary"] = result.content
+        except Exception as e:
+            # Dropping the old turns still keeps the prompt bounded
+            print(f"Context summarization failed, truncating instead: {e}")
+    return update
+
 # Individual node wrappers to handle the async agent calls
 async def onboarding_node(state: AgentState):
-    agent = await get_onboarding_agent()
+    agent = await get_agent("onboarding")
     result = await agent.ainvoke(state)
     return {"messages": result["messages"]}
 
 async def banking_node(state: AgentState):
-    agent = await get_banking_agent()
+    agent = await get_agent("banking")
     result = await agent.ainvoke(state)
     return {"messages": result["messages"]}
 
+def render_balances(accounts: List[Dict]) -> str:
+    if not accounts:
+        return "You don't have any accounts with us yet."
+    lines = [f"- {a['type']} account {a['account_number']}: ${float(a['balance'] or 0):,.2f}" for a in accounts]
+    if len(accounts) == 1:
+        return "Here is your account balance:\n" + lines[0]
+    total = sum(float(a["balance"] or 0) for a in accounts)
+    return "Here are your account balances:\n" + "\n".join(lines) + f"\nTotal across all accounts: ${total:,.2f}"
+
+async def fast_path_node(state: AgentState):
+    # Calls the balance tool directly for the authenticated customer and answers from a template
+    tools = {t.name: t for t in await get_tools_cached()}
+    try:
+        output = content_text(await tools["get_account_balance"].ainvoke({"customer_id": state["customer_info"]["id"]}))
+        accounts = json.loads(output) if output else []
+        if not isinstance(accounts, list) or any("error" in a for a in accounts):
+            raise ValueError(output)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Fast path falling back to the banking agent: {e}")
+        return await banking_node(state)
+    return {"messages": [AIMessage(content=render_balances(accounts))]}
+
 async def advisory_node(state: AgentState):
-    agent = await get_advisory_agent()
-    result = await agent.ainvoke(state)
-    return {"messages": result["messages"]}
+    # Generic policy questions are answered from the semantic cache when a close enough question was seen before
+    query = state["messages"][-1].content
+    cacheable = SEMANTIC_CACHE_ENABLED and is_cacheable_query(query)
+    if cacheable:
+        version = await policy_corpus_version()
+        vector = await embedding_service.embed(query)
+        cached = advisory_cache.lookup(vector, version)
+        if cached is not None:
+            return {"messages": [AIMessage(content=cached)]}
+    
+    agent = await get_agent("advisory")
+    if not cacheable:
+        result = await agent.ainvoke(state)
+        return {"messages": result["messages"]}
+    # The cache is shared by every customer: answer from the question alone, without the customer's
+    # identity, summary or earlier turns, so nothing personal is stored or served to someone else
+    result = await agent.ainvoke({"messages": [state["messages"][-1]], "customer_info": {}, "auth_status": state["auth_status"], "summary": ""})
+    answer = result["messages"][-1]
+    advisory_cache.store(vector, version, answer.content)
+    return {"messages": [answer]}
 
 # Build Workflow
 workflow = StateGraph(AgentState)
 
+workflow.add_node("compact", compact_node)
 workflow.add_node("onboarding", onboarding_node)
 workflow.add_node("banking", banking_node)
 workflow.add_node("advisory", advisory_node)
+workflow.add_node("fast_path", fast_path_node)
 
 # Entry point logic using a "routing" node or set_entry_point with conditional
 def entry_router(state: AgentState):
     return router(state)
 
-workflow.set_conditional_entry_point(
+workflow.set_entry_point("compact")
+workflow.add_conditional_edges(
+    "compact",
     entry_router,
     {
         "onboarding": "onboarding",
         "banking": "banking",
-        "advisory": "advisory"
+        "advisory": "advisory",
+        "fast_path": "fast_path"
     }
 )
 
 workflow.add_edge("onboarding", END)
 workflow.add_edge("banking", END)
 workflow.add_edge("advisory", END)
+workflow.add_edge("fast_path", END)
 
+# Stateless graph for callers without a conversation thread; the checkpointed one is compiled on first use
 graph = workflow.compile()
+_threaded_graph = None
 
-async def process_query(query: str, customer_info: Dict, auth_status: bool):
-    # Ensure tools are initialized before running graph
-    await get_tools_cached()
+async def graph_for(customer_info: Dict, thread_id: Optional[str] = None):
+    """Returns (graph, config): the checkpointed graph on the customer's thread, or the stateless graph."""
+    global _threaded_graph
+    # turn_id identifies this chat turn to the tool pool (idempotency keys for write tools, memo of read-only calls)
+    configurable = {"turn_id": uuid.uuid4().hex}
+    # Tools that take a customer_id always get the authenticated customer's (see MCPToolPool._make_tool)
+    if customer_info.get("id") is not None:
+        configurable["customer_id"] = customer_info["id"]
+    # Times every LLM and tool call of the turn (see telemetry.py)
+    callbacks = [telemetry_callback]
+    thread = thread_id_for(customer_info, thread_id)
+    if thread is None:
+        return graph, {"configurable": configurable, "callbacks": callbacks}
+    if _threaded_graph is None:
+        _threaded_graph = workflow.compile(checkpointer=await get_checkpointer())
+    return _threaded_graph, {"configurable": {**configurable, "thread_id": thread}, "callbacks": callbacks}
+
+async def clear_conversation(customer_info: Dict, thread_id: Optional[str] = None):
+    thread = thread_id_for(customer_info, thread_id)
+    if thread is not None:
+        await (await get_checkpointer()).adelete_thread(thread)
+
+async def process_query(query: str, customer_info: Dict, auth_status: bool, thread_id: Optional[str] = None):
+    # Ensure tools and agents are initialized before running graph
+    await warm_agents()
     
-    initial_state = {
+    # Only the new message is sent; earlier turns come from the thread's checkpoint
+    turn = {
         "messages": [HumanMessage(content=query)],
         "customer_info": customer_info,
         "auth_status": auth_status
     }
     
-    result = await graph.ainvoke(initial_state)
+    graph, config = await graph_for(customer_info, thread_id)
+    result = await graph.ainvoke(turn, config)
     return result["messages"][-1].content
+
+def content_text(content) -> str:
+    # MCP tool results arrive as a list of content blocks
+    if isinstance(content, list):
+        return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content)
+
+async def stream_events(query: str, customer_info: Dict, auth_status: bool, thread_id: Optional[str] = None):
+    """
+    Runs the graph like process_query, but yields progress events as they happen:
+      {"type": "token", "text": ...}                  LLM output tokens
+      {"type": "tool_start", "tool": ..., "input": ...}
+      {"type": "tool_end", "tool": ..., "output": ...}
+      {"type": "done", "response": ...}               final answer (same text process_query returns)
+    """
+    await warm_agents()
+    
+    turn = {
+        "messages": [HumanMessage(content=query)],
+        "customer_info": customer_info,
+        "auth_status": auth_status
+    }
+    
+    graph, config = await graph_for(customer_info, thread_id)
+    response = ""
+    streamed = False
+    async for event in graph.astream_events(turn, config, version="v2"):
+        kind = event["event"]
+        if SUMMARY_TAG in event.get("tags", []):
+            continue
+        if kind == "on_chat_model_stream":
+            chunk = event["data"]["chunk"]
+            # Steps that only request tool calls carry no text; skip them
+            if isinstance(chunk.content, str) and chunk.content and not chunk.tool_call_chunks:
+                streamed = True
+                yield {"type": "token", "text": chunk.content}
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # Root graph finished: its last message is the answer (also covers answers produced without an LLM call)
+            response = event["data"]["output"]["messages"][-1].content
+            if not streamed:
+                yield {"type": "token", "text": response}
+        elif kind == "on_tool_start":
+            yield {"type": "tool_start", "tool": event["name"], "input": event["data"].get("input")}
+        elif kind == "on_tool_end":
+            output = event["data"].get("output")
+            yield {"type": "tool_end", "tool": event["name"], "output": content_text(getattr(output, "content", output))[:TOOL_EVENT_MAX_CHARS]}
+    yield {"type": "done", "response": response}
+
+async def stream_query(query: str, customer_info: Dict, auth_status: bool, thread_id: Optional[str] = None):
+    """Same as process_query, but yields the answer's LLM tokens as they are generated."""
+    async for event in stream_events(query, customer_info, auth_status, thread_id):
+        if event["type"] == "token":
+            yield event["text"]
@@ -0,0 +1,235 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from jose import JWTError, jwt
+from sqlalchemy import select, delete
+from database import AsyncSessionLocal, RevokedToken
+from notifications import hub, notify
+from user_cache import CustomerSnapshot, user_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Without a notification listener, revocations made by other processes are picked up by reloading this often
+REVOCATION_RELOAD_SECONDS = float(os.getenv("REVOCATION_RELOAD_SECONDS", "30"))
+REVOCATION_CHANNEL = "token_revocations"
+
+def to_datetime(timestamp: float) -> datetime.datetime:
+    # Stored as naive UTC, like every other DateTime column
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+def epoch(moment: datetime.datetime) -> float:
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def create_access_token(data: dict) -> str:
+    """
+    data holds sub (email) and the claims get_current_user needs: uid, name (and email),
+    so verifying a token needs no database query. jti identifies the token for logout.
+    """
+    now = time.time()
+    to_encode = data.copy()
+    to_encode.update({"iat": now, "exp": int(now + ACCESS_TOKEN_EXPIRE_MINUTES * 60), "jti": uuid.uuid4().hex})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+class InvalidToken(Exception):
+    pass
+
+class RevocationSet:
+    """
+    Revoked tokens, kept in memory in every process. The revoked_tokens table is the source of truth:
+    it is loaded at first use, and revoke_*() NOTIFY on commit so every other process applies them too.
+    """
+
+    def __init__(self):
+        self.tokens: Dict[str, float] = {}     # jti -> exp (dropped once the token has expired anyway)
+        self.customers: Dict[int, float] = {}  # customer_id -> tokens issued before this are revoked
+        self.ready = False
+        self.loaded_at = 0.0
+        self._lock = None
+        self._pending = None  # revocations received while loading
+        hub.subscribe(REVOCATION_CHANNEL, self._on_event, on_reset=self._on_reset)
+
+    def is_revoked(self, jti: Optional[str], customer_id: int, issued_at: float) -> bool:
+        if jti is not None and jti in self.tokens:
+            return True
+        revoked_before = self.customers.get(customer_id)
+        return revoked_before is not None and issued_at < revoked_before
+
+    async def ensure_ready(self):
+        if self.ready and (hub.listening or time.monotonic() - self.loaded_at < REVOCATION_RELOAD_SECONDS):
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.ready and (hub.listening or time.monotonic() - self.loaded_at < REVOCATION_RELOAD_SECONDS):
+                return
+            await hub.start()
+            await self.load()
+
+    async def load(self):
+        self._pending = []
+        tokens, customers = {}, {}
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(RevokedToken.jti, RevokedToken.customer_id, RevokedToken.revoked_before, RevokedToken.expires_at)
+                    .where(RevokedToken.expires_at > datetime.datetime.utcnow())
+                )).all()
+            for jti, customer_id, revoked_before, expires_at in rows:
+                self._apply(tokens, customers, {
+                    "jti": jti, "customer_id": customer_id, "exp": epoch(expires_at),
+                    "revoked_before": epoch(revoked_before) if revoked_before else None,
+                })
+            for data in self._pending:
+                self._apply(tokens, customers, data)
+            self.tokens, self.customers = tokens, customers
+            self.ready = True
+            self.loaded_at = time.monotonic()
+        finally:
+            self._pending = None
+
+    @staticmethod
+    def _apply(tokens: Dict, customers: Dict, data: Dict):
+        if data.get("jti"):
+            tokens[data["jti"]] = data["exp"]
+        elif data.get("revoked_before") is not None:
+            customer_id = data["customer_id"]
+            customers[customer_id] = max(customers.get(customer_id, 0.0), data["revoked_before"])
+
+    def _on_event(self, data: Dict):
+        if self._pending is not None:
+            self._pending.append(data)
+        elif self.ready:
+            self._apply(self.tokens, self.customers, data)
+
+    def _on_reset(self):
+        # Revocations may have been missed: reload before the next verification
+        self.ready = False
+
+    async def revoke_token(self, db, jti: str, customer_id: int, exp: float):
+        """Call inside a transaction; applied here at once and in every other process on commit."""
+        data = {"jti": jti, "customer_id": customer_id, "exp": exp}
+        db.add(RevokedToken(jti=jti, customer_id=customer_id, expires_at=to_datetime(exp)))
+        await self._record(db, data)
+
+    async def revoke_customer(self, db, customer_id: int):
+        """Revokes every token the customer holds now (logout everywhere, or when disabling the customer)."""
+        now = time.time()
+        data = {"customer_id": customer_id, "revoked_before": now}
+        db.add(RevokedToken(
+            customer_id=customer_id, revoked_before=to_datetime(now),
+            expires_at=to_datetime(now + ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+        ))
+        await self._record(db, data)
+
+    async def _record(self, db, data: Dict):
+        self._apply(self.tokens, self.customers, data)
+        await notify(db, REVOCATION_CHANNEL, data)
+        # Rare enough to purge expired revocations on the way
+        await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.datetime.utcnow()))
+        now = time.time()
+        self.tokens = {jti: exp for jti, exp in self.tokens.items() if exp > now}
+        horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        self.customers = {cid: before for cid, before in self.customers.items() if before > horizon}
+
+class TokenVerifier:
+    """
+    Turns a bearer token into the caller without touching the database: the claims carry id, name and
+    email, and tokens already verified are kept in an LRU (until their exp) so the signature is checked
+    once per token. Revocation is checked on every request, against the in-memory RevocationSet.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.revocations = RevocationSet()
+        self._items = OrderedDict()  # token -> (CustomerSnapshot, jti, issued_at, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    async def authenticate(self, token: str) -> CustomerSnapshot:
+        return (await self._check(token))[0]
+
+    async def _check(self, token: str) -> Tuple[CustomerSnapshot, Optional[str], float, float]:
+        await self.revocations.ensure_ready()
+        with self._lock:
+            entry = self._items.get(token)
+            if entry is not None:
+                self._items.move_to_end(token)
+        if entry is None:
+            self.misses += 1
+            entry = await self._verify(token)
+            with self._lock:
+                self._items[token] = entry
+                while len(self._items) > self.max_entries:
+                    self._items.popitem(last=False)
+        else:
+            self.hits += 1
+        user, jti, issued_at, exp = entry
+        if exp <= time.time():
+            self.discard(token)
+            self.rejected += 1
+            raise InvalidToken("Token expired")
+        if self.revocations.is_revoked(jti, user.id, issued_at):
+            self.rejected += 1
+            raise InvalidToken("Token revoked")
+        return entry
+
+    async def _verify(self, token: str) -> Tuple[CustomerSnapshot, Optional[str], float, float]:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            self.rejected += 1
+            raise InvalidToken(str(e))
+        email = payload.get("sub")
+        if email is None:
+            self.rejected += 1
+            raise InvalidToken("Token has no subject")
+        if "uid" in payload:
+            user = CustomerSnapshot(payload["uid"], payload.get("name"), email, None, True)
+        else:
+            # Tokens issued before the claims were added: look the customer up once
+            user = await user_cache.get_customer(email)
+            if user is None:
+                self.rejected += 1
+                raise InvalidToken("Unknown customer")
+        return user, payload.get("jti"), float(payload.get("iat", 0)), float(payload.get("exp", float("inf")))
+
+    async def logout(self, token: str, everywhere: bool = False):
+        user, jti, _, exp = await self._check(token)
+        async with AsyncSessionLocal() as db:
+            if everywhere or jti is None:
+                await self.revocations.revoke_customer(db, user.id)
+            else:
+                await self.revocations.revoke_token(db, jti, user.id, exp)
+            await db.commit()
+        self.discard(token)
+
+    def discard(self, token: str):
+        with self._lock:
+            self._items.pop(token, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "revoked_tokens": len(self.revocations.tokens),
+            "revoked_customers": len(self.revocations.customers),
+            "revocations_ready": self.revocations.ready,
+        }
+
+token_verifier = TokenVerifier()
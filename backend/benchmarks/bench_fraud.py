@@ -0,0 +1,92 @@
+"""
+Benchmark for the in-memory fraud engine (fraud.py).
+
+Replays a synthetic transaction log (many accounts, a few regular payees each, occasional bursts and
+outsized payments) through score() + observe() exactly as transfer_funds does, and reports per-call
+latency and throughput. With --rebuild, also times a rebuild from the transactions table.
+
+    cd backend
+    python -m benchmarks.bench_fraud --accounts 10000 --transactions 1000000
+    python -m benchmarks.bench_fraud --rebuild
+"""
+import argparse
+import asyncio
+import random
+import time
+import numpy as np
+from fraud import FraudEngine, FraudAssessment
+
+def synthetic_log(accounts: int, transactions: int, seed: int):
+    """Yields (account_id, amount, counterparty, ts) in time order, ~30 days of activity."""
+    rng = random.Random(seed)
+    typical = [rng.lognormvariate(4, 1) for _ in range(accounts)]
+    payees = [[f"P{rng.randrange(accounts * 10):08d}" for _ in range(rng.randint(2, 8))] for _ in range(accounts)]
+    ts = time.time() - 30 * 86400
+    step = 30 * 86400 / transactions
+    burst = []
+    for _ in range(transactions):
+        ts += step
+        if burst:
+            account = burst.pop()
+        else:
+            account = rng.randrange(accounts)
+            if rng.random() < 0.001:
+                burst = [account] * rng.randint(5, 10)
+        amount = round(typical[account] * rng.lognormvariate(0, 0.3), 2)
+        counterparty = rng.choice(payees[account])
+        if rng.random() < 0.002:
+            amount *= rng.randint(10, 100)
+            counterparty = f"N{rng.randrange(10**8):08d}"
+        yield account, amount, counterparty, ts
+
+def replay(engine: FraudEngine, log, sample_every: int):
+    score_ns, observe_ns = [], []
+    flagged = 0
+    started = time.perf_counter()
+    for i, (account, amount, counterparty, ts) in enumerate(log):
+        if i % sample_every:
+            flagged += engine.score(account, amount, counterparty, ts).flagged
+            engine.observe(account, amount, counterparty, ts)
+            continue
+        t0 = time.perf_counter_ns()
+        assessment: FraudAssessment = engine.score(account, amount, counterparty, ts)
+        t1 = time.perf_counter_ns()
+        engine.observe(account, amount, counterparty, ts)
+        t2 = time.perf_counter_ns()
+        flagged += assessment.flagged
+        score_ns.append(t1 - t0)
+        observe_ns.append(t2 - t1)
+    return time.perf_counter() - started, score_ns, observe_ns, flagged
+
+async def time_rebuild():
+    from database import async_engine
+    from notifications import hub
+    engine = FraudEngine()
+    started = time.perf_counter()
+    await engine.rebuild()
+    print(f"rebuild from the database: {time.perf_counter() - started:.2f}s, {engine.observed} payments, {len(engine.profiles)} accounts")
+    await hub.close()
+    await async_engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--sample-every", type=int, default=10, help="time one call in N (timer overhead)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rebuild", action="store_true", help="also time a rebuild against DATABASE_URL")
+    args = parser.parse_args()
+
+    engine = FraudEngine()
+    elapsed, score_ns, observe_ns, flagged = replay(engine, synthetic_log(args.accounts, args.transactions, args.seed), args.sample_every)
+    print(f"{args.transactions} transactions over {args.accounts} accounts: {elapsed:.2f}s, {args.transactions / elapsed:,.0f} tx/s (incl. log generation)")
+    for name, samples in (("score", score_ns), ("observe", observe_ns)):
+        p50, p99 = np.percentile(samples, [50, 99]) / 1000
+        print(f"{name:8s} p50={p50:.1f}us  p99={p99:.1f}us")
+    print(f"flagged {flagged} ({flagged / args.transactions:.3%})")
+
+    if args.rebuild:
+        asyncio.run(time_rebuild())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark for the transaction history service (history.py).
+
+Seeds a scratch customer with many accounts, each holding years of interleaved transactions, then times statement pages (first, deep via cursor, date-bounded) and a full NDJSON export,
+and prints the plan of a deep page.
+
+    cd backend
+    python -m benchmarks.bench_history --accounts 200 --per-account 20000
+"""
+import argparse
+import asyncio
+import datetime
+import time
+import uuid
+import numpy as np
+from sqlalchemy import select, delete, text, tuple_
+from database import AsyncSessionLocal, Customer, Account, Transaction, async_engine, create_tables
+import history
+
+async def seed(run_id: str, accounts: int, per_account: int, years: int) -> list:
+    async with AsyncSessionLocal() as db:
+        customer = Customer(full_name="History Bench", email=f"history-{run_id}@example.com")
+        db.add(customer)
+        await db.flush()
+        rows = [Account(customer_id=customer.id, account_number=f"HB{run_id}{i:05d}", account_type="Checking", balance=0) for i in range(accounts)]
+        db.add_all(rows)
+        await db.flush()
+        ids = [a.id for a in rows]
+        # Interleaved across accounts, spread evenly over `years`
+        await db.execute(text("""
+            INSERT INTO transactions (account_id, amount, transaction_type, description, is_fraudulent, created_at)
+            SELECT a.id,
+                   CASE WHEN g % 3 = 0 THEN (g % 500) + 0.25 ELSE -((g % 200) + 0.75) END,
+                   CASE WHEN g % 3 = 0 THEN 'Credit' ELSE 'Debit' END,
+                   'bench', false,
+                   now() at time zone 'utc' - make_interval(secs => g * (:years * 365 * 86400.0 / :n))
+            FROM unnest(CAST(:ids AS int[])) AS a(id), generate_series(1, :n) AS g
+        """), {"ids": ids, "n": per_account, "years": years})
+        await db.commit()
+    async with async_engine.connect() as conn:
+        await conn.execute(text("ANALYZE transactions"))
+    return [(a.id, a.account_number) for a in rows], customer.id
+
+async def teardown(customer_id: int):
+    async with AsyncSessionLocal() as db:
+        account_ids = select(Account.id).where(Account.customer_id == customer_id)
+        await db.execute(delete(Transaction).where(Transaction.account_id.in_(account_ids)))
+        await db.execute(delete(Account).where(Account.customer_id == customer_id))
+        await db.execute(delete(Customer).where(Customer.id == customer_id))
+        await db.commit()
+
+async def timed(samples: list, coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.append((time.perf_counter() - started) * 1000)
+    return result
+
+def report(name: str, samples: list):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    print(f"{name:22s} p50={p50:.2f}ms  p95={p95:.2f}ms  p99={p99:.2f}ms  (n={len(samples)})")
+
+async def run(args):
+    create_tables()
+    run_id = uuid.uuid4().hex[:8]
+    started = time.perf_counter()
+    accounts, customer_id = await seed(run_id, args.accounts, args.per_account, args.years)
+    print(f"seeded {args.accounts * args.per_account:,} transactions in {time.perf_counter() - started:.1f}s")
+
+    first, deep, bounded = [], [], []
+    async with AsyncSessionLocal() as db:
+        for account_id, _ in accounts[:args.queries]:
+            page = await timed(first, history.get_page(db, account_id, args.page_size))
+            # Walk a few pages, then jump deep: keyset pages cost the same wherever they start
+            for _ in range(3):
+                page = await timed(deep, history.get_page(db, account_id, args.page_size, page["next_cursor"]))
+            oldest = page["transactions"][-1]["date"]
+            await timed(bounded, history.get_page(db, account_id, args.page_size, since=datetime.datetime.fromisoformat(oldest) - datetime.timedelta(days=365)))
+
+        account_id = accounts[0][0]
+        cursor = history.encode_cursor(datetime.datetime.utcnow() - datetime.timedelta(days=365 * args.years - 30), 0)
+        plan = (await db.execute(text("EXPLAIN ANALYZE " + str(
+            history.history_query(account_id)
+            .where(tuple_(Transaction.created_at, Transaction.id) < history.decode_cursor(cursor))
+            .limit(args.page_size + 1)
+            .compile(compile_kwargs={"literal_binds": True})
+        )))).scalars().all()
+
+    report("first page", first)
+    report("next pages (cursor)", deep)
+    report("date-bounded page", bounded)
+    print("plan of a page near the oldest end:")
+    for line in plan:
+        print("   ", line)
+
+    started = time.perf_counter()
+    lines = 0
+    async for chunk in history.export_ndjson(accounts[0][0]):
+        lines += chunk.count("\n")
+    elapsed = time.perf_counter() - started
+    print(f"export {lines:,} rows as NDJSON: {elapsed:.2f}s ({lines / elapsed:,.0f} rows/s)")
+
+    if not args.keep:
+        await teardown(customer_id)
+    await async_engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--per-account", type=int, default=20000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=100, help="accounts to page through")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch customer, accounts and transactions")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Recall/latency benchmark: HNSW index vs exact scan for policy retrieval.
+
+Builds a scratch table with synthetic, clustered unit vectors of EMBEDDING_DIM (same index settings as
+policy_vectors), then compares top-k results and query latency for several hnsw.ef_search values.
+
+    cd backend
+    python -m benchmarks.bench_rag --rows 20000 --queries 200 --ef-search 20,40,80,160
+"""
+import argparse
+import time
+import numpy as np
+from sqlalchemy import text
+from database import engine, EMBEDDING_DIM, HNSW_M, HNSW_EF_CONSTRUCTION
+
+TABLE = "bench_policy_vectors"
+
+def to_pgvector(vector) -> str:
+    return "[" + ",".join(f"{v:.6f}" for v in vector) + "]"
+
+def synthetic_vectors(n: int, dim: int, clusters: int, rng) -> np.ndarray:
+    # Clustered data is closer to real embeddings than uniform noise (and harder for ANN recall)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    points = centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+def load(conn, vectors: np.ndarray, batch: int = 1000):
+    conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    conn.execute(text(f"CREATE TABLE {TABLE} (id serial PRIMARY KEY, embedding vector({vectors.shape[1]}))"))
+    conn.execute(text(f"ALTER TABLE {TABLE} ALTER COLUMN embedding SET STORAGE PLAIN"))  # as policy_vectors
+    for start in range(0, len(vectors), batch):
+        conn.execute(
+            text(f"INSERT INTO {TABLE} (embedding) VALUES (CAST(:embedding AS vector))"),
+            [{"embedding": to_pgvector(v)} for v in vectors[start:start + batch]],
+        )
+    started = time.perf_counter()
+    conn.execute(text(
+        f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_l2_ops) "
+        f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    ))
+    print(f"HNSW build: {time.perf_counter() - started:.2f}s for {len(vectors)} rows")
+    conn.execute(text(f"ANALYZE {TABLE}"))
+
+def run_queries(conn, queries: np.ndarray, k: int, exact: bool, ef_search: int = 40):
+    results, latencies = [], []
+    statement = text(f"SELECT id FROM {TABLE} ORDER BY embedding <-> CAST(:q AS vector) LIMIT :k")
+    for q in queries:
+        params = {"q": to_pgvector(q), "k": k}
+        # One transaction per query so SET LOCAL cannot leak into the next measurement
+        with conn.begin():
+            if exact:
+                conn.execute(text("SET LOCAL enable_indexscan = off"))
+            else:
+                conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+            started = time.perf_counter()
+            rows = conn.execute(statement, params).scalars().all()
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.append(set(rows))
+    return results, np.array(latencies)
+
+def report(label: str, latencies: np.ndarray, recall: float):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{label:<18} recall@k={recall:.3f}  p50={p50:.2f}ms  p95={p95:.2f}ms  p99={p99:.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--ef-search", default="20,40,80,160")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table afterwards")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(args.rows, args.dim, args.clusters, rng)
+    queries = synthetic_vectors(args.queries, args.dim, args.clusters, rng)
+
+    with engine.connect() as conn:
+        with conn.begin():
+            load(conn, vectors)
+        truth, latencies = run_queries(conn, queries, args.k, exact=True)
+        report("exact scan", latencies, 1.0)
+        for ef in [int(v) for v in args.ef_search.split(",")]:
+            found, latencies = run_queries(conn, queries, args.k, exact=False, ef_search=ef)
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            report(f"hnsw ef_search={ef}", latencies, recall)
+        if not args.keep:
+            with conn.begin():
+                conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+if __name__ == "__main__":
+    main()
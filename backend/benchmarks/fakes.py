@@ -0,0 +1,151 @@
+"""
+Offline stand-ins for the network services, used by the load test (and selectable for any run):
+
+    LLM_BACKEND=fake        agents.llm is FakeChatModel instead of ChatOllama
+    EMBEDDING_BACKEND=fake  embedding_service uses FakeEmbeddings instead of OllamaEmbeddings
+    TTS_BACKEND=local       tts.py synthesizes a tone instead of calling edge-tts
+
+The fakes are deterministic (same input, same tool calls / vectors) and sleep for a configurable
+latency, so agent and API overhead can be measured without a GPU or network access.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import List
+from types import SimpleNamespace
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))       # time to first token
+FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "5"))             # per streamed token
+FAKE_EMBEDDING_LATENCY_MS = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "20"))
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", "3072"))          # llama3.2's size, so projection runs too
+FAKE_STT_RTF = float(os.getenv("FAKE_STT_RTF", "0.1"))                     # seconds of work per second of audio
+
+CUSTOMER_ID = re.compile(r"customer_id=(\d+)")
+ACCOUNT = re.compile(r"\b[A-Z]{2}[A-Za-z0-9]{4,}\b")
+AMOUNT = re.compile(r"\$\s?(\d+(?:\.\d{1,2})?)")
+
+class FakeChatModel(BaseChatModel):
+    """
+    Plays the ReAct loop deterministically: the first call of a turn requests the tool that matches
+    the user's message (among the tools bound to the agent), the call after the tool result answers
+    with a short sentence built from it. Without bound tools (e.g. the summarizer) it just answers.
+    """
+    tool_names: List[str] = []
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+    token_ms: float = FAKE_LLM_TOKEN_MS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [convert_to_openai_tool(t)["function"]["name"] for t in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Here is what I found. {str(last.content)[:160]} Is there anything else I can help with?")
+        if not self.tool_names:
+            return AIMessage(content="The customer asked about their accounts and got answers.")
+        call = self._tool_call(messages, str(last.content))
+        if call is None:
+            return AIMessage(content="I can help with balances, transfers, transaction history and bank policies.")
+        name, args = call
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": "call_" + hashlib.md5(json.dumps([name, args]).encode()).hexdigest()[:12]}])
+
+    def _tool_call(self, messages: List[BaseMessage], text: str):
+        system = next((str(m.content) for m in messages if isinstance(m, SystemMessage)), "")
+        customer = CUSTOMER_ID.search(system)
+        customer_id = int(customer.group(1)) if customer else None
+        accounts = ACCOUNT.findall(text)
+        amount = AMOUNT.search(text)
+        lowered = text.lower()
+        available = set(self.tool_names)
+        if "query_policy_rag" in available:
+            return "query_policy_rag", {"search_query": text}
+        if "transfer_funds" in available and "transfer" in lowered and len(accounts) >= 2 and amount:
+            return "transfer_funds", {"from_account": accounts[0], "to_account": accounts[1], "amount": float(amount.group(1))}
+        if "get_transaction_history" in available and customer_id and accounts and re.search(r"transactions?|history|statement", lowered):
+            return "get_transaction_history", {"account_number": accounts[0], "customer_id": customer_id, "limit": 5}
+        if "get_account_balance" in available and customer_id:
+            return "get_account_balance", {"customer_id": customer_id}
+        if "get_customer_profile" in available:
+            email = re.search(r"[\w.+-]+@[\w-]+\.[\w.]+", text)
+            if email:
+                return "get_customer_profile", {"email": email.group(0)}
+        return None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_ms / 1000)
+        message = self._reply(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ]))
+            return
+        for word in message.content.split(" "):
+            await asyncio.sleep(self.token_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(word + " ", chunk=chunk)
+            yield chunk
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by the text's hash (same text, same vector)."""
+
+    def __init__(self, dim: int = FAKE_EMBEDDING_DIM, latency_ms: float = FAKE_EMBEDDING_LATENCY_MS):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency_ms / 1000)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._vector(text)
+
+class FakeWhisperModel:
+    """Stands in for faster_whisper.WhisperModel: burns FAKE_STT_RTF seconds per audio second (in the STT thread)."""
+
+    def __init__(self, text: str = "What is my account balance?", rtf: float = FAKE_STT_RTF):
+        self.text = text
+        self.rtf = rtf
+
+    def transcribe(self, audio, **kwargs):
+        duration = len(audio) / 16000
+        time.sleep(duration * self.rtf)
+        info = SimpleNamespace(duration=duration, duration_after_vad=duration)
+        return iter([SimpleNamespace(text=self.text)]), info
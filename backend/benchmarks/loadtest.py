@@ -0,0 +1,215 @@
+"""
+Offline load test for the API: runs the FastAPI app in-process (httpx ASGITransport, no server or
+network), with the LLM, embeddings, STT and TTS replaced by the deterministic fakes in
+benchmarks/fakes.py, against the Postgres at DATABASE_URL (pgvector; SQLite can't run the
+row locks, full-text and vector queries the tools use).
+
+Seeds scratch customers, accounts and policy chunks (removed afterwards), then for every scenario
+and concurrency level keeps that many requests in flight (closed loop) and reports p50/p95/p99
+latency and throughput.
+
+    cd backend
+    python -m benchmarks.loadtest --scenarios login,chat_balance,chat_agent,chat_policy,voice,mcp --concurrency 1,4,16,64
+    python -m benchmarks.loadtest --requests 400 --json results.json   # save for comparing runs
+
+Fake latencies are set with FAKE_LLM_LATENCY_MS, FAKE_LLM_TOKEN_MS, FAKE_EMBEDDING_LATENCY_MS,
+FAKE_STT_RTF and TTS_LOCAL_MS_PER_CHAR.
+"""
+import os
+
+# Before any app module is imported: they read their backends at import time
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+os.environ.setdefault("TTS_BACKEND", "local")
+os.environ.setdefault("WHISPER_WARMUP", "false")
+
+import argparse
+import asyncio
+import io
+import json
+import sys
+import time
+import uuid
+import wave
+from decimal import Decimal
+import httpx
+import numpy as np
+from sqlalchemy import select, delete
+from database import AsyncSessionLocal, Customer, Account, Transaction, PolicyVector, async_engine, create_tables
+from benchmarks.fakes import FakeWhisperModel
+import main as api
+from agents import clear_conversation
+from mcp_pool import tool_pool
+from seed_rag import builtin_documents, ingest
+from stt import stt
+
+PASSWORD = "loadtest-password"
+POLICY_QUESTIONS = [
+    "What is the ACH clearing policy?",
+    "How long does cheque clearing take?",
+    "What is the policy for wire transfers?",
+    "Can you suggest an investment for a beginner?",
+]
+
+def tone_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    samples = (3000 * np.sin(2 * np.pi * 220 * np.arange(int(seconds * sample_rate)) / sample_rate)).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+async def seed(run_id: str, count: int):
+    password_hash = api.get_password_hash(PASSWORD)  # bcrypt once, shared by all scratch users
+    async with AsyncSessionLocal() as db:
+        customers = [
+            Customer(full_name=f"Load Test {i}", email=f"loadtest-{run_id}-{i}@example.com", hashed_password=password_hash, is_authenticated=True)
+            for i in range(count)
+        ]
+        db.add_all(customers)
+        await db.flush()
+        accounts = []
+        for i, customer in enumerate(customers):
+            for kind in ("Checking", "Savings"):
+                accounts.append(Account(customer_id=customer.id, account_number=f"LT{run_id}{i:04d}{kind[0]}", account_type=kind, balance=Decimal("100000")))
+        db.add_all(accounts)
+        await db.commit()
+        users = []
+        for customer in customers:
+            owned = [a.account_number for a in accounts if a.customer_id == customer.id]
+            users.append({"id": customer.id, "email": customer.email, "accounts": owned})
+    # Policy chunks embedded with the fake embeddings, under a source of their own: the real corpus is left alone
+    documents = [{**d, "source": f"loadtest-{run_id}"} for d in builtin_documents()]
+    await asyncio.to_thread(ingest, documents)
+    return users
+
+async def teardown(run_id: str, users):
+    ids = [u["id"] for u in users]
+    for user in users:
+        await clear_conversation({"id": user["id"]}, "loadtest")
+    async with AsyncSessionLocal() as db:
+        account_ids = select(Account.id).where(Account.customer_id.in_(ids))
+        await db.execute(delete(Transaction).where(Transaction.account_id.in_(account_ids)))
+        await db.execute(delete(Account).where(Account.customer_id.in_(ids)))
+        await db.execute(delete(Customer).where(Customer.id.in_(ids)))
+        await db.execute(delete(PolicyVector).where(PolicyVector.source == f"loadtest-{run_id}"))
+        await db.commit()
+
+async def login(client, user) -> httpx.Response:
+    return await client.post("/login", data={"username": user["email"], "password": PASSWORD})
+
+def chat(message):
+    async def request(client, user):
+        return await client.post("/chat", json={"message": message(user), "thread_id": "loadtest"}, headers=user["headers"])
+    return request
+
+async def voice(client, user) -> httpx.Response:
+    files = {"file": ("question.wav", user["audio"], "audio/wav")}
+    return await client.post("/voice", files=files, data={"thread_id": "loadtest"}, headers=user["headers"])
+
+async def mcp_call(client, user):
+    # Straight to the MCP worker pool, bypassing HTTP and the agents
+    started = time.perf_counter()
+    await tool_pool.call("get_account_balance", {"customer_id": user["id"]})
+    return time.perf_counter() - started
+
+SCENARIOS = {
+    "login": login,
+    "chat_balance": chat(lambda u: "What is my account balance?"),                           # deterministic fast path
+    "chat_agent": chat(lambda u: f"Show the recent transactions for {u['accounts'][0]}"),      # router + LLM + tool + LLM
+    "chat_transfer": chat(lambda u: f"Transfer $1.00 from {u['accounts'][0]} to {u['accounts'][1]}"),
+    "chat_policy": chat(lambda u: POLICY_QUESTIONS[u["turn"] % len(POLICY_QUESTIONS)]),       # advisory, RAG, semantic cache
+    "voice": voice,
+    "mcp": mcp_call,
+}
+
+async def run_level(client, scenario: str, users, concurrency: int, requests: int):
+    call = SCENARIOS[scenario]
+    latencies, errors = [], []
+    remaining = iter(range(requests))
+
+    async def worker(user):
+        for _ in remaining:
+            user["turn"] += 1
+            started = time.perf_counter()
+            try:
+                response = await call(client, user)
+                if isinstance(response, httpx.Response) and response.status_code >= 400:
+                    errors.append(f"{response.status_code} {response.text[:120]}")
+                    continue
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    # One user per in-flight request, so concurrent turns never share a conversation thread
+    await asyncio.gather(*(worker(users[i % len(users)]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float("nan"),) * 3
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "rps": round(len(latencies) / elapsed, 1),
+        "sample_errors": errors[:3],
+    }
+
+async def run(args) -> bool:
+    create_tables()
+    if args.stt == "fake":
+        stt._model = FakeWhisperModel()
+    await api.startup()
+    run_id = uuid.uuid4().hex[:6]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    users = await seed(run_id, max(levels))
+    results = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://loadtest", timeout=args.timeout) as client:
+            audio = tone_wav(args.audio_seconds)
+            for user in users:
+                token = (await login(client, user)).json()["access_token"]
+                user.update(headers={"Authorization": f"Bearer {token}"}, audio=audio, turn=0)
+
+            print(f"{'scenario':14s} {'conc':>5s} {'ok':>6s} {'err':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'req/s':>8s}")
+            for scenario in args.scenarios.split(","):
+                for concurrency in levels:
+                    result = await run_level(client, scenario, users, concurrency, max(args.requests, concurrency))
+                    results.append(result)
+                    print(f"{scenario:14s} {concurrency:5d} {result['ok']:6d} {result['errors']:5d} "
+                          f"{result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f} {result['rps']:8.1f}")
+                    for error in result["sample_errors"]:
+                        print(f"    {error}")
+    finally:
+        if not args.keep:
+            await teardown(run_id, users)
+        await api.shutdown()
+        await async_engine.dispose()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"run_id": run_id, "args": vars(args), "results": results}, f, indent=2)
+    return all(r["errors"] == 0 for r in results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="login,chat_balance,chat_agent,chat_policy,voice,mcp", help=f"comma-separated: {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and level")
+    parser.add_argument("--audio-seconds", type=float, default=3.0, help="length of the /voice upload")
+    parser.add_argument("--stt", choices=["fake", "whisper"], default="fake", help="whisper loads the real WHISPER_MODEL")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch customers, accounts and policy chunks")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
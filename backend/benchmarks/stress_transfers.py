@@ -0,0 +1,119 @@
+"""
+Concurrency stress test for the transfer engine (transfers.py).
+
+Creates a scratch customer with a few accounts, fires many random transfers between them in parallel,
+and replays a share of them with the same idempotency key (as a retried tool call would). Then checks:
+money is conserved, no balance went negative, every successful transfer posted exactly one debit and
+one credit, and replays returned the original response without posting again.
+
+    cd backend
+    python -m benchmarks.stress_transfers --accounts 10 --transfers 1000 --concurrency 200
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import select, delete, func
+from database import AsyncSessionLocal, Customer, Account, Transaction, IdempotencyKey, async_engine, create_tables
+from transfers import transfer_funds
+
+async def setup(run_id: str, accounts: int, opening_balance: Decimal):
+    async with AsyncSessionLocal() as db:
+        customer = Customer(full_name="Stress Test", email=f"stress-{run_id}@example.com")
+        db.add(customer)
+        await db.flush()
+        numbers = [f"ST{run_id}{i:04d}" for i in range(accounts)]
+        db.add_all([Account(customer_id=customer.id, account_number=n, account_type="Checking", balance=opening_balance) for n in numbers])
+        await db.commit()
+        return customer.id, numbers
+
+async def teardown(customer_id: int, run_id: str):
+    async with AsyncSessionLocal() as db:
+        account_ids = select(Account.id).where(Account.customer_id == customer_id)
+        await db.execute(delete(Transaction).where(Transaction.account_id.in_(account_ids)))
+        await db.execute(delete(Account).where(Account.customer_id == customer_id))
+        await db.execute(delete(Customer).where(Customer.id == customer_id))
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key.like(f"stress-{run_id}-%")))
+        await db.commit()
+
+async def run(args) -> bool:
+    create_tables()
+    run_id = uuid.uuid4().hex[:8]
+    opening = Decimal(str(args.opening_balance)).quantize(Decimal("0.01"))
+    customer_id, numbers = await setup(run_id, args.accounts, opening)
+    rng = random.Random(args.seed)
+
+    requests = []
+    for i in range(args.transfers):
+        source, target = rng.sample(numbers, 2)
+        amount = Decimal(rng.randint(1, int(args.max_amount * 100))) / 100
+        requests.append((source, target, amount, f"stress-{run_id}-{i}"))
+    # Replays of the same request (same key) race the original
+    replays = rng.sample(requests, int(len(requests) * args.replay_ratio))
+    calls = requests + replays
+    rng.shuffle(calls)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, responses = [], {}
+
+    async def call(source, target, amount, key):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await transfer_funds(source, target, amount, "stress", key)
+            latencies.append((time.perf_counter() - started) * 1000)
+            responses.setdefault(key, []).append(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(*c) for c in calls))
+    elapsed = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        balances = (await db.execute(select(Account.balance).where(Account.customer_id == customer_id))).scalars().all()
+        posted = (await db.execute(
+            select(func.count()).select_from(Transaction).join(Account, Transaction.account_id == Account.id).where(Account.customer_id == customer_id)
+        )).scalar()
+
+    succeeded = sum(1 for r in responses.values() if r[0].startswith("Successfully"))
+    insufficient = sum(1 for r in responses.values() if "Insufficient" in r[0])
+    errors = [r[0] for r in responses.values() if r[0].startswith("Error") and "Insufficient" not in r[0]]
+    checks = {
+        "money conserved": sum(balances) == opening * len(numbers),
+        "no negative balance": min(balances) >= 0,
+        "one debit + one credit per transfer": posted == 2 * succeeded,
+        "replays return the original response": all(len(set(r)) == 1 for r in responses.values()),
+        "no unexpected errors": not errors,
+    }
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{len(calls)} calls ({len(replays)} replays) with {args.concurrency} in flight: {elapsed:.2f}s, {len(calls) / elapsed:.0f} calls/s")
+    print(f"latency p50={p50:.1f}ms  p95={p95:.1f}ms  p99={p99:.1f}ms")
+    print(f"{succeeded} transfers posted, {insufficient} rejected for insufficient funds")
+    for error in errors[:5]:
+        print(f"  unexpected: {error}")
+    for name, ok in checks.items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+
+    if not args.keep:
+        await teardown(customer_id, run_id)
+    await async_engine.dispose()
+    return all(checks.values())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--transfers", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--replay-ratio", type=float, default=0.2)
+    parser.add_argument("--opening-balance", type=float, default=500)
+    parser.add_argument("--max-amount", type=float, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch customer, accounts and transactions")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from database import EMBEDDING_DIM
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+# A dedicated (smaller) embedding model can be used instead of the chat model; its output is
+# projected to EMBEDDING_DIM only when it is larger than that
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", os.getenv("MODEL_NAME", "llama3.2"))
+EMBEDDING_PROJECTION_SEED = int(os.getenv("EMBEDDING_PROJECTION_SEED", "42"))
+
+# ollama, or fake for offline load tests (hash-seeded vectors, see benchmarks/fakes.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")
+
+def embedding_fingerprint() -> str:
+    """Identifies the vector space embeddings are computed in; stored vectors from another space are re-embedded."""
+    return f"{EMBEDDING_BACKEND}:{EMBEDDING_MODEL}:{EMBEDDING_DIM}:{EMBEDDING_PROJECTION_SEED}"
+
+def embeddings_client() -> Embeddings:
+    if EMBEDDING_BACKEND == "fake":
+        from benchmarks.fakes import FakeEmbeddings
+        return FakeEmbeddings()
+    return OllamaEmbeddings(
+        model=EMBEDDING_MODEL,
+        base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    )
+
+_projections = {}
+
+def reduce_dimensions(vector: List[float], dim: int = EMBEDDING_DIM) -> List[float]:
+    """
+    Projects an embedding down to `dim` dimensions with a fixed Gaussian random projection
+    (Johnson-Lindenstrauss: pairwise distances are approximately preserved), then L2-normalizes it.
+    Indexing and querying must use the same seed and dim, so both go through this function.
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    if len(array) < dim:
+        raise ValueError(f"Embedding has {len(array)} dimensions, fewer than EMBEDDING_DIM={dim}")
+    if len(array) > dim:
+        projection = _projections.get((len(array), dim))
+        if projection is None:
+            rng = np.random.default_rng(EMBEDDING_PROJECTION_SEED)
+            projection = (rng.standard_normal((len(array), dim)) / np.sqrt(dim)).astype(np.float32)
+            _projections[(len(array), dim)] = projection
+        array = array @ projection
+    norm = np.linalg.norm(array)
+    return (array / norm if norm else array).tolist()
+
+class EmbeddingService:
+    """
+    Process-wide query embedder:
+    - one embeddings client, so its HTTP connection pool is reused across calls
+    - LRU cache keyed on the normalized query text
+    - concurrent requests for the same text share a single in-flight embed call
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE):
+        self.client = embeddings_client()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._cache = OrderedDict()
+        self._in_flight = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(str(text).lower().split())
+
+    async def embed(self, text: str) -> List[float]:
+        key = self.normalize(text)
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return vector
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+        # shield: a cancelled caller must not cancel the embed other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str) -> List[float]:
+        try:
+            vector = reduce_dimensions(await self.client.aembed_query(key))
+            self._cache[key] = vector
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            return vector
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+embedding_service = EmbeddingService()
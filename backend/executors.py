@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class ExecutorBusy(Exception):
+    """Raised when a pool's queue is full; the API turns it into a 503 with Retry-After."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} executor is busy")
+        self.name = name
+        self.retry_after = retry_after
+
+class BoundedExecutor:
+    """Thread pool for blocking work with a cap on queued jobs (backpressure instead of unbounded waits)."""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, retry_after: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.pending = 0  # running + queued
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def _done(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusy(self.name, self.retry_after)
+            self.pending += 1
+        # Count the job until the thread actually finishes, even if the awaiting request is cancelled
+        future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = self.pending
+            return {
+                "workers": self.max_workers,
+                "active": min(pending, self.max_workers),
+                "queued": max(pending - self.max_workers, 0),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# bcrypt and CTranslate2 both release the GIL, so threads give real parallelism for these pools
+hash_executor = BoundedExecutor(
+    "hash",
+    max_workers=int(os.getenv("HASH_WORKERS", "4")),
+    max_queue=int(os.getenv("HASH_QUEUE_SIZE", "64")),
+    retry_after=int(os.getenv("HASH_RETRY_AFTER", "1")),
+)
+stt_executor = BoundedExecutor(
+    "stt",
+    max_workers=int(os.getenv("STT_WORKERS", "2")),
+    max_queue=int(os.getenv("STT_QUEUE_SIZE", "8")),
+    retry_after=int(os.getenv("STT_RETRY_AFTER", "5")),
+)
+
+# Silero VAD checks for /ws/voice: a few ms each, so they get their own pool instead of queueing behind Whisper jobs
+vad_executor = BoundedExecutor(
+    "vad",
+    max_workers=int(os.getenv("VAD_WORKERS", "2")),
+    max_queue=int(os.getenv("VAD_QUEUE_SIZE", "64")),
+    retry_after=int(os.getenv("VAD_RETRY_AFTER", "1")),
+)
+
+def executor_stats() -> Dict:
+    return {e.name: e.stats() for e in (hash_executor, stt_executor, vad_executor)}
@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import math
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from sqlalchemy import select, func
+from database import AsyncSessionLocal, Transaction
+from notifications import hub, notify
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Scoring rules (score >= FRAUD_FLAG_THRESHOLD flags the transaction)
+FRAUD_FLAG_THRESHOLD = float(os.getenv("FRAUD_FLAG_THRESHOLD", "0.6"))
+FRAUD_HIGH_VALUE = float(os.getenv("FRAUD_HIGH_VALUE", "5000"))             # same limit the agents were told about
+FRAUD_MIN_HISTORY = int(os.getenv("FRAUD_MIN_HISTORY", "5"))                # payments before the amount profile is trusted
+FRAUD_ZSCORE = float(os.getenv("FRAUD_ZSCORE", "3"))
+FRAUD_VELOCITY_WINDOW = int(os.getenv("FRAUD_VELOCITY_WINDOW", "600"))      # seconds
+FRAUD_VELOCITY_MAX = int(os.getenv("FRAUD_VELOCITY_MAX", "5"))              # payments per velocity window
+FRAUD_DAILY_LIMIT = float(os.getenv("FRAUD_DAILY_LIMIT", "10000"))          # outgoing total per 24h
+FRAUD_NEW_PAYEE_AMOUNT = float(os.getenv("FRAUD_NEW_PAYEE_AMOUNT", "1000"))
+# How much history the in-memory state is rebuilt from at startup
+FRAUD_HISTORY_DAYS = int(os.getenv("FRAUD_HISTORY_DAYS", "180"))
+FRAUD_REBUILD_BATCH = int(os.getenv("FRAUD_REBUILD_BATCH", "5000"))
+# Without a notification listener, transfers made by other processes are picked up by rebuilding this often
+FRAUD_RELOAD_SECONDS = float(os.getenv("FRAUD_RELOAD_SECONDS", "60"))
+FRAUD_EVENTS_CHANNEL = "fraud_events"
+DAY = 86400
+
+def epoch(moment: datetime.datetime) -> float:
+    # created_at is stored as naive UTC
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+class SlidingWindow:
+    """Count and sum of the events in the last `seconds`; every event is appended and expired once (amortized O(1))."""
+    __slots__ = ("seconds", "events", "total")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.events = deque()
+        self.total = 0.0
+
+    def expire(self, now: float):
+        while self.events and self.events[0][0] <= now - self.seconds:
+            self.total -= self.events.popleft()[1]
+
+    def add(self, ts: float, amount: float):
+        self.events.append((ts, amount))
+        self.total += amount
+
+class AccountProfile:
+    """Outgoing-payment features of one account, updated in O(1) per transaction."""
+    __slots__ = ("count", "mean", "m2", "velocity", "daily", "counterparties")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Welford's running sum of squared deviations
+        self.velocity = SlidingWindow(FRAUD_VELOCITY_WINDOW)
+        self.daily = SlidingWindow(DAY)
+        self.counterparties = set()
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def observe(self, amount: float, counterparty: Optional[str], ts: float):
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.velocity.expire(ts)
+        self.velocity.add(ts, amount)
+        self.daily.expire(ts)
+        self.daily.add(ts, amount)
+        if counterparty:
+            self.counterparties.add(counterparty)
+
+@dataclass
+class FraudAssessment:
+    score: float
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def flagged(self) -> bool:
+        return self.score >= FRAUD_FLAG_THRESHOLD
+
+    def as_dict(self) -> Dict:
+        if self.flagged:
+            return {
+                "status": "Flagged",
+                "score": round(self.score, 2),
+                "reason": "; ".join(self.reasons),
+                "action_required": "Email confirmation sent to customer as per policy."
+            }
+        return {"status": "Clean", "score": round(self.score, 2), "reason": "; ".join(self.reasons) or "Normal transaction pattern"}
+
+class FraudEngine:
+    """
+    In-memory fraud scoring over outgoing payments, keyed by account id.
+    Scoring reads only process memory (no database queries on the transfer path). The state follows
+    committed transfers from every process through NOTIFY and is rebuilt from history at startup. When
+    events were missed, or every FRAUD_RELOAD_SECONDS while the notification listener is down, it is
+    rebuilt in the background while scoring goes on against the current profiles.
+    """
+
+    def __init__(self):
+        self.profiles: Dict[int, AccountProfile] = {}
+        self.origin = uuid.uuid4().hex  # tags this process's own events, which are applied locally
+        self.ready = False
+        self.rebuilt_at = 0.0
+        self._stale = False  # events were missed since the last rebuild
+        self._refresh_task = None
+        self.observed = 0
+        self.scored = 0
+        self._lock = asyncio.Lock()
+        self._pending = None  # events received while rebuilding
+        hub.subscribe(FRAUD_EVENTS_CHANNEL, self._on_event, on_reset=self._on_reset)
+
+    def score(self, account_id: int, amount: float, counterparty: Optional[str] = None, ts: Optional[float] = None) -> FraudAssessment:
+        self.scored += 1
+        ts = time.time() if ts is None else ts
+        reasons = []
+        score = 0.0
+        if amount > FRAUD_HIGH_VALUE:
+            score += 0.6
+            reasons.append("High value transaction")
+
+        profile = self.profiles.get(account_id)
+        if profile is not None and profile.count:
+            if profile.count >= FRAUD_MIN_HISTORY:
+                std = profile.std
+                z = (amount - profile.mean) / std if std else (math.inf if amount > 3 * profile.mean else 0.0)
+                if z >= FRAUD_ZSCORE:
+                    score += min(0.4, 0.1 * z)
+                    reasons.append("Amount far above this account's usual payments")
+            profile.velocity.expire(ts)
+            if len(profile.velocity.events) + 1 > FRAUD_VELOCITY_MAX:
+                score += 0.3
+                reasons.append(f"More than {FRAUD_VELOCITY_MAX} payments in {FRAUD_VELOCITY_WINDOW // 60} minutes")
+            profile.daily.expire(ts)
+            if profile.daily.total + amount > FRAUD_DAILY_LIMIT:
+                score += 0.3
+                reasons.append("Daily outgoing limit exceeded")
+            if counterparty and counterparty not in profile.counterparties and amount >= FRAUD_NEW_PAYEE_AMOUNT:
+                score += 0.3
+                reasons.append("Large first payment to a new payee")
+        return FraudAssessment(min(score, 1.0), reasons)
+
+    def observe(self, account_id: int, amount: float, counterparty: Optional[str], ts: float):
+        self._observe(self.profiles, account_id, amount, counterparty, ts)
+
+    def _observe(self, profiles: Dict[int, AccountProfile], account_id: int, amount: float, counterparty: Optional[str], ts: float):
+        profile = profiles.get(account_id)
+        if profile is None:
+            profile = profiles[account_id] = AccountProfile()
+        profile.observe(amount, counterparty, ts)
+        self.observed += 1
+
+    async def publish(self, db, transaction: Transaction):
+        """Call inside the transfer's transaction (after flush): other processes apply it once it commits."""
+        await notify(db, FRAUD_EVENTS_CHANNEL, {
+            "origin": self.origin,
+            "id": transaction.id,
+            "account_id": transaction.account_id,
+            "amount": abs(float(transaction.amount)),
+            "counterparty": transaction.counterparty_account,
+            "ts": epoch(transaction.created_at),
+        })
+
+    def _on_event(self, data: Dict):
+        if data.get("origin") == self.origin:
+            return
+        if self._pending is not None:
+            self._pending.append(data)
+        elif self.ready:
+            self.observe(data["account_id"], data["amount"], data.get("counterparty"), data["ts"])
+
+    def _on_reset(self):
+        # Events were missed: rebuild on next use
+        self._stale = True
+
+    async def ensure_ready(self):
+        if not self.ready:
+            async with self._lock:
+                if not self.ready:
+                    await hub.start()
+                    await self.rebuild()
+            return
+        if self._stale or (not hub.listening and time.monotonic() - self.rebuilt_at >= FRAUD_RELOAD_SECONDS):
+            # Never on the caller's path: the rebuild queries the transactions table
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            async with self._lock:
+                await hub.start()
+                await self.rebuild()
+        except Exception as e:
+            print(f"Fraud engine rebuild failed, keeping the current profiles: {e}", file=sys.stderr)
+            # The task stays alive until then, so callers don't start a new attempt on every transfer
+            await asyncio.sleep(FRAUD_RELOAD_SECONDS)
+
+    async def rebuild(self):
+        """Replays recent outgoing payments from the transactions table, streaming rows in batches."""
+        started = time.perf_counter()
+        self._stale = False
+        self._pending = []
+        # Built aside and swapped in at the end, so scoring never sees a half-built state
+        profiles = {}
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=FRAUD_HISTORY_DAYS)
+        try:
+            async with AsyncSessionLocal() as db:
+                max_id = (await db.execute(select(func.max(Transaction.id)))).scalar() or 0
+                rows = await db.stream(
+                    select(Transaction.account_id, Transaction.amount, Transaction.counterparty_account, Transaction.created_at)
+                    .where(Transaction.transaction_type == "Debit", Transaction.created_at >= cutoff, Transaction.id <= max_id)
+                    .order_by(Transaction.created_at, Transaction.id)
+                    .execution_options(yield_per=FRAUD_REBUILD_BATCH)
+                )
+                async for account_id, amount, counterparty, created_at in rows:
+                    self._observe(profiles, account_id, abs(float(amount)), counterparty, epoch(created_at))
+            # Events that arrived while reading; a transaction committed mid-rebuild with an id <= max_id
+            # may be missed (as may this process's own transfers committed after max_id was read),
+            # which only makes its account's features slightly stale
+            for data in self._pending:
+                if data["id"] > max_id:
+                    self._observe(profiles, data["account_id"], data["amount"], data.get("counterparty"), data["ts"])
+            self.profiles = profiles
+            self.ready = True
+            self.rebuilt_at = time.monotonic()
+        finally:
+            self._pending = None
+        print(f"Fraud engine rebuilt {len(profiles)} account profiles in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+    def stats(self) -> Dict:
+        return {"accounts": len(self.profiles), "observed": self.observed, "scored": self.scored, "ready": self.ready}
+
+fraud_engine = FraudEngine()
@@ -0,0 +1,48 @@
+# Production launch: gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each worker also runs its own MCP_POOL_SIZE tool processes and (on first voice request) its own Whisper,
+# so size this against memory as well as cores
+workers = int(os.getenv("WEB_CONCURRENCY", str(max(2, multiprocessing.cpu_count() // 2))))
+# The app sizes its per-process pools from this (database.MULTI_WORKER), so export the actual count
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Postgres connection budget, at peak:
+#   workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW + CHECKPOINT_POOL_SIZE + 1 LISTEN
+#              + MCP_POOL_SIZE * (DB_POOL_SIZE + DB_MAX_OVERFLOW + 1 LISTEN))
+# With more than one worker the defaults are 2 + 3, 2 and 2 MCP workers: 20 per worker, 80 for 4 workers.
+# Keep it well under max_connections (Postgres defaults to 100; compose.yml raises it to 200) and leave
+# room for seed_rag.py, migrations and admin sessions. Set MCP_TRANSPORT=streamable_http to share MCP
+# servers between workers instead of spawning MCP_POOL_SIZE per worker.
+
+# Import main (FastAPI, LangChain/LangGraph, faster-whisper, ...) once in the master and fork the workers
+# from it: workers start in well under a second and share those pages copy-on-write. Nothing that owns
+# threads, sockets or models is created at import time (Whisper, the MCP pool and DB connections all
+# start inside each worker), so forking after the import is safe.
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Requests (LLM turns, voice) can be long; the worker timeout only guards against hung workers
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+# Recycle workers periodically (with jitter so they don't all restart at once); 0 disables
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+errorlog = "-"
+
+# Prometheus multiprocess mode: every worker writes its metrics here and /metrics aggregates them.
+# Emptied here, in the master, before the app (and prometheus_client) is imported.
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,100 @@
+import base64
+import datetime
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import select, tuple_
+from database import AsyncSessionLocal, Account, Transaction
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+# Rows fetched per round trip while exporting (server-side cursor)
+HISTORY_EXPORT_BATCH = int(os.getenv("HISTORY_EXPORT_BATCH", "1000"))
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not produced by encode_cursor (or was tampered with)."""
+
+def encode_cursor(created_at: datetime.datetime, transaction_id: int) -> str:
+    """Opaque position after the last row of a page: (created_at, id) of that row."""
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), transaction_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        created_at, transaction_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(created_at), int(transaction_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+def transaction_dict(row) -> Dict:
+    return {
+        "id": row.id,
+        "date": row.created_at.isoformat(),
+        "type": row.transaction_type,
+        "amount": float(row.amount),
+        "description": row.description,
+        "counterparty_account": row.counterparty_account,
+        "flagged": bool(row.is_fraudulent),
+    }
+
+# Columns only: rows are never materialized as ORM objects
+COLUMNS = (
+    Transaction.id,
+    Transaction.created_at,
+    Transaction.transaction_type,
+    Transaction.amount,
+    Transaction.description,
+    Transaction.counterparty_account,
+    Transaction.is_fraudulent,
+)
+
+def naive_utc(moment: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # created_at is stored as naive UTC
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+def history_query(account_id: int, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None):
+    # Matches ix_transactions_account_created exactly, so every page is an index range scan
+    query = (
+        select(*COLUMNS)
+        .where(Transaction.account_id == account_id)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+    )
+    if since:
+        query = query.where(Transaction.created_at >= naive_utc(since))
+    if until:
+        query = query.where(Transaction.created_at < naive_utc(until))
+    return query
+
+async def owned_account_id(db, account_number: str, customer_id: int) -> Optional[int]:
+    """The account's id if it belongs to the customer, else None (unknown and foreign accounts look the same)."""
+    return (await db.execute(
+        select(Account.id).where(Account.account_number == account_number, Account.customer_id == customer_id)
+    )).scalar()
+
+async def get_page(db, account_id: int, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None,
+                   since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> Dict:
+    """
+    One page of an account's history, newest first. Keyset pagination: the cursor carries the
+    (created_at, id) of the last row, so page N costs the same as page 1 (no OFFSET).
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    query = history_query(account_id, since, until)
+    if cursor:
+        query = query.where(tuple_(Transaction.created_at, Transaction.id) < decode_cursor(cursor))
+    # One extra row tells whether there is a next page
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    items: List[Dict] = [transaction_dict(r) for r in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return {"transactions": items, "next_cursor": next_cursor}
+
+async def export_ndjson(account_id: int, since: Optional[datetime.datetime] = None,
+                        until: Optional[datetime.datetime] = None) -> AsyncIterator[str]:
+    """Whole history as NDJSON lines, streamed through a server-side cursor (memory stays flat)."""
+    async with AsyncSessionLocal() as db:
+        rows = await db.stream(history_query(account_id, since, until).execution_options(yield_per=HISTORY_EXPORT_BATCH))
+        async for partition in rows.partitions():
+            yield "".join(json.dumps(transaction_dict(r)) + "\n" for r in partition)
@@ -0,0 +1,46 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Queries classified at or above this confidence skip the LLM entirely (see fast_path_node in agents.py)
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.9"))
+
+@dataclass
+class Intent:
+    name: Optional[str]
+    confidence: float
+
+# Plain requests to see balances: "what's my balance?", "show my account balances", "how much money do I have"
+BALANCE_PATTERNS = [
+    re.compile(r"^\s*(my\s+)?(account\s+)?balances?\s*[?.!]*\s*$"),
+    re.compile(r"\b(what('?s| is| are)|show|check|see|view|list|get|tell me|give me)\b.*\b(my|account|accounts)\b.*\bbalances?\b"),
+    re.compile(r"\bbalances?\b.*\b(my|all)\b.*\baccounts?\b"),
+    re.compile(r"\bhow much (money )?(do i have|is (there )?in my|have i got)\b"),
+]
+# Anything that asks for more than a read of current balances goes to the agent
+NOT_A_BALANCE_CHECK = re.compile(
+    r"\b(transfer|send|pay|move|withdraw|deposit|after|if|would|could|should|when|why|policy|policies|minimum|"
+    r"interest|fees?|transactions?|history|statement|update|change|address|open|apply|loan|card|close|fraud)\b"
+)
+# A specific account number or an amount means the user wants something narrower than the full list
+SPECIFIC_DETAIL = re.compile(r"\b[a-z]{2}\d{3,}\b|\$\s?\d|\b\d+(\.\d+)?\s*(dollars|usd)\b")
+MAX_FAST_PATH_WORDS = 12
+
+def classify_intent(query: str) -> Intent:
+    """Deterministic classifier for the read-only intents the fast path can answer."""
+    lowered = query.lower().strip()
+    if not any(p.search(lowered) for p in BALANCE_PATTERNS):
+        return Intent(None, 0.0)
+    if NOT_A_BALANCE_CHECK.search(lowered):
+        return Intent(None, 0.0)
+    confidence = 0.95
+    if SPECIFIC_DETAIL.search(lowered):
+        confidence -= 0.3
+    if len(lowered.split()) > MAX_FAST_PATH_WORDS:
+        confidence -= 0.2
+    return Intent("check_balance", confidence)
@@ -3,29 +3,37 @@ import os
 # Workaround for OpenMP error on Mac (Abort trap: 6)
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, status
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
-import shutil
+from datetime import datetime
 import os
-import uuid
-from faster_whisper import WhisperModel
-import edge_tts
 import asyncio
-from agents import process_query
-from database import SessionLocal, Customer, Account, Transaction
-from pydantic import BaseModel, EmailStr
+import base64
+import time
+import json
+from agents import clear_conversation, process_query, stream_events, stream_query, warm_agents
+from memory import close_checkpointer
+from mcp_pool import tool_pool
+from executors import ExecutorBusy, hash_executor, stt_executor, vad_executor, executor_stats
+from stt import WHISPER_WARMUP, stt
+from voice_stream import SpeechSegmenter, SentenceChunker
+from tts import tts
+from semantic_cache import advisory_cache
+from embedding_service import embedding_service
+from user_cache import CustomerSnapshot, user_cache
+from auth import InvalidToken, create_access_token, token_verifier
+import history
+from notifications import hub as notification_hub
+from telemetry import TRACE_HEADERS, REQUEST_SECONDS, metrics_response, server_timing, stage, stats_collector, trace_scope
+from sqlalchemy import select
+from database import AsyncSessionLocal, Customer, Account, Transaction
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 
-# Security Config
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
-
+# Security Config (JWT settings live in auth.py)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -39,6 +47,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# blocking: startup waits for the warm-up (single process / dev)
+# background: the worker serves /health at once and warms up in the background; /ready turns 200 when done
+# lazy: no warm-up, the MCP tools, agents and Whisper load on first use
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background")
+WARMUP_RETRY_DELAY = float(os.getenv("WARMUP_RETRY_DELAY", "5"))
+warmup_state = {"agents": False, "stt": False, "error": None}
+# /ws/voice: seconds a client has after connecting to send its {"type": "auth"} frame
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+_warmup_task = None
+
+async def warm_up():
+    # Spawn the MCP tools and compile the agents once, before the first chat/voice turn
+    started = time.perf_counter()
+    while True:
+        try:
+            await warm_agents()
+            warmup_state["agents"] = True
+            if WHISPER_WARMUP:
+                await stt_executor.run(stt.warm_up)
+            warmup_state["stt"] = True
+            warmup_state["error"] = None
+            break
+        except Exception as e:
+            if WARMUP_MODE == "blocking":
+                raise
+            warmup_state["error"] = str(e)
+            print(f"Warm-up failed, retrying in {WARMUP_RETRY_DELAY}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_DELAY)
+    print(f"Worker {os.getpid()} ready in {time.perf_counter() - started:.1f}s")
+
+@app.on_event("startup")
+async def startup():
+    global _warmup_task
+    if WARMUP_MODE == "blocking":
+        await warm_up()
+    elif WARMUP_MODE == "background":
+        _warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _warmup_task:
+        _warmup_task.cancel()
+    await tool_pool.stop()
+    hash_executor.shutdown()
+    stt_executor.shutdown()
+    vad_executor.shutdown()
+    await notification_hub.close()
+    await close_checkpointer()
+
+@app.middleware("http")
+async def request_telemetry(request, call_next):
+    # Outermost middleware: latency histogram per route, plus the per-stage breakdown as Server-Timing
+    started = time.perf_counter()
+    with trace_scope() as trace:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", response.status_code).observe(elapsed)
+    if TRACE_HEADERS or request.headers.get("x-trace") == "1":
+        # Streaming responses only include the stages finished before the first byte
+        response.headers["Server-Timing"] = server_timing(trace, elapsed)
+    return response
+
+# Gauges for the pools and caches, read from their stats() at scrape time
+stats_collector.register("executor", executor_stats, label="executor")
+stats_collector.register("tool_pool", tool_pool.stats, label="worker")
+stats_collector.register("tool_memo", tool_pool.memo.stats)
+stats_collector.register("advisory_cache", advisory_cache.stats)
+stats_collector.register("embedding_cache", embedding_service.stats)
+stats_collector.register("user_cache", user_cache.stats)
+stats_collector.register("token_cache", token_verifier.stats)
+stats_collector.register("tts", tts.stats)
+stats_collector.register("stt", stt.stats)
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request, exc: ExecutorBusy):
+    # Backpressure: shed load instead of queueing blocking work without bound
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy ({exc.name}), please retry"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Auth Utilities
 def verify_password(plain_password, hashed_password):
     # bcrypt limit is 72 bytes. Passlib handles this, but some backends error out.
@@ -47,32 +138,20 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password[:72])
 
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await user_from_token(token)
+
+async def user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # No database query: the token carries id, name and email, and verified tokens are cached until they expire
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    db = SessionLocal()
-    user = db.query(Customer).filter(Customer.email == email).first()
-    db.close()
-    if user is None:
+        return await token_verifier.authenticate(token)
+    except InvalidToken:
         raise credentials_exception
-    return user
 
 # Models
 class RegisterRequest(BaseModel):
@@ -88,28 +167,27 @@ class LoginRequest(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    stream: bool = False # Server-Sent Events with tokens and tool progress instead of one JSON answer
+    thread_id: Optional[str] = Field(None, max_length=64) # Separate conversation within the user's memory (default: one per user)
 
 # Endpoints
 @app.post("/register")
 async def register(req: RegisterRequest):
-    db = SessionLocal()
-    if db.query(Customer).filter(Customer.email == req.email).first():
-        db.close()
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    new_user = Customer(
-        first_name=req.first_name,
-        last_name=req.last_name,
-        full_name=f"{req.first_name} {req.last_name}",
-        email=req.email,
-        hashed_password=get_password_hash(req.password),
-        registration_number=req.registration_number,
-        is_authenticated=True
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    db.close()
+    async with AsyncSessionLocal() as db:
+        if (await db.execute(select(Customer).where(Customer.email == req.email))).scalars().first():
+            raise HTTPException(status_code=400, detail="Email already registered")
+        
+        new_user = Customer(
+            first_name=req.first_name,
+            last_name=req.last_name,
+            full_name=f"{req.first_name} {req.last_name}",
+            email=req.email,
+            hashed_password=await hash_executor.run(get_password_hash, req.password),
+            registration_number=req.registration_number,
+            is_authenticated=True
+        )
+        db.add(new_user)
+        await db.commit()
     
     # Mock Email Notification
     print(f"MOCK EMAIL SENT TO {req.email}: Welcome {req.first_name}! Your registration is successful.")
@@ -118,83 +196,279 @@ async def register(req: RegisterRequest):
 
 @app.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    db = SessionLocal()
-    user = db.query(Customer).filter(Customer.email == form_data.username).first()
-    db.close()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(Customer).where(Customer.email == form_data.username))).scalars().first()
+    if not user or not await hash_executor.run(verify_password, form_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "uid": user.id, "name": user.full_name, "email": user.email})
     return {"access_token": access_token, "token_type": "bearer", "user": {"name": user.full_name, "email": user.email}}
 
+@app.post("/logout")
+async def logout(everywhere: bool = Query(False), token: str = Depends(oauth2_scheme)):
+    # Revokes this token (or every token of the customer) in all workers
+    try:
+        await token_verifier.logout(token, everywhere)
+    except InvalidToken:
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    return {"message": "Logged out"}
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest, current_user: Customer = Depends(get_current_user)):
-    customer_info = {"id": current_user.id, "name": current_user.full_name, "email": current_user.email}
-    response_text = await process_query(request.message, customer_info, True)
+async def chat_endpoint(request: ChatRequest, current_user: CustomerSnapshot = Depends(get_current_user)):
+    customer_info = current_user.as_customer_info()
+    if request.stream:
+        return StreamingResponse(
+            chat_event_stream(request.message, customer_info, request.thread_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    response_text = await process_query(request.message, customer_info, True, request.thread_id)
     return {"response": response_text}
 
+@app.delete("/chat/history")
+async def clear_chat_history(thread_id: Optional[str] = Query(None, max_length=64), current_user: CustomerSnapshot = Depends(get_current_user)):
+    await clear_conversation(current_user.as_customer_info(), thread_id)
+    return {"message": "Conversation cleared"}
+
+async def chat_event_stream(message: str, customer_info: dict, thread_id: Optional[str] = None):
+    try:
+        async for event in stream_events(message, customer_info, True, thread_id):
+            yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    except Exception as e:
+        print(f"ERROR in chat stream: {str(e)}")
+        yield f"event: error\ndata: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+async def owned_account_or_404(db, account_number: str, current_user: CustomerSnapshot) -> int:
+    account_id = await history.owned_account_id(db, account_number, current_user.id)
+    if account_id is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return account_id
+
+@app.get("/accounts/{account_number}/transactions")
+async def transaction_history(
+    account_number: str,
+    limit: int = Query(history.HISTORY_PAGE_SIZE, ge=1, le=history.HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, max_length=200),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: CustomerSnapshot = Depends(get_current_user),
+):
+    async with AsyncSessionLocal() as db:
+        account_id = await owned_account_or_404(db, account_number, current_user)
+        try:
+            page = await history.get_page(db, account_id, limit, cursor, since, until)
+        except history.InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"account_number": account_number, **page}
+
+@app.get("/accounts/{account_number}/transactions/export")
+async def export_transactions(
+    account_number: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: CustomerSnapshot = Depends(get_current_user),
+):
+    async with AsyncSessionLocal() as db:
+        account_id = await owned_account_or_404(db, account_number, current_user)
+    return StreamingResponse(
+        history.export_ndjson(account_id, since, until),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{account_number}-transactions.ndjson"'},
+    )
+
 @app.post("/voice")
-async def voice_endpoint(file: UploadFile = File(...), current_user: Customer = Depends(get_current_user)):
-    # 1. Save uploaded file
-    file_id = str(uuid.uuid4())
-    input_path = os.path.join(UPLOAD_DIR, f"{file_id}_in.wav")
-    
+async def voice_endpoint(file: UploadFile = File(...), thread_id: Optional[str] = Form(None, max_length=64), current_user: CustomerSnapshot = Depends(get_current_user)):
     try:
-        content = await file.read()
+        # 1. Read the upload into memory (no temp files)
+        with stage("upload_read"):
+            content = await file.read()
         if not content:
             raise HTTPException(status_code=400, detail="Empty audio file received")
             
-        print(f"DEBUG: Received audio file {file.filename}, size: {len(content)} bytes")
-        
-        with open(input_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # 2. Transcribe (STT)
-        segments, info = stt_model.transcribe(input_path, beam_size=5)
-        user_text = " ".join([segment.text for segment in segments])
+        # 2. Decode + transcribe (STT) on the bounded STT pool, off the event loop
+        with stage("stt"):
+            transcription = await stt_executor.run(stt.transcribe_bytes, content)
+        user_text = transcription.text
         
         if not user_text.strip():
             user_text = "[No speech detected]"
         
         # 3. Process with Agents
-        customer_info = {"id": current_user.id, "name": current_user.full_name, "email": current_user.email}
-        response_text = await process_query(user_text, customer_info, True)
+        customer_info = current_user.as_customer_info()
+        with stage("agent"):
+            response_text = await process_query(user_text, customer_info, True, thread_id)
         
-        # 4. Generate Voice Response (TTS)
-        output_path = os.path.join(UPLOAD_DIR, f"{file_id}_out.mp3")
-        communicate = edge_tts.Communicate(response_text, "en-US-AvaNeural")
-        await communicate.save(output_path)
+        # 4. Generate Voice Response (TTS), returned inline: any worker can serve the request, with nothing kept
+        # Sentences are synthesized in parallel and served from the phrase cache when repeated
+        with stage("tts"):
+            audio = await tts.synthesize(response_text)
         
         return {
             "user_text": user_text,
             "response_text": response_text,
-            "audio_url": f"/audio/{file_id}_out.mp3"
+            "audio": base64.b64encode(audio).decode("ascii"),
+            "media_type": tts.media_type,
+            "stt": transcription.as_dict()
         }
+    except (HTTPException, ExecutorBusy):
+        raise
     except Exception as e:
         print(f"ERROR in voice_endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+async def close_with_error(websocket: WebSocket, code: int, payload: dict):
+    try:
+        await websocket.send_text(json.dumps(payload))
+        await websocket.close(code=code)
+    except Exception:
+        pass # client already gone
+
+@app.websocket("/ws/voice")
+async def voice_ws(websocket: WebSocket, thread_id: Optional[str] = Query(None, max_length=64)):
+    """
+    Streaming voice turn. Protocol:
+      client -> first {"type": "auth", "token": "<access token>"} (never in the URL: URLs end up in access logs),
+                then binary frames of PCM16 mono 16 kHz audio, and {"type": "end"} when the user stops talking
+      server -> {"type": "transcript_partial"|"transcript"|"token"|"done"|"error", ...} text frames
+                and MP3 audio as binary frames, sentence by sentence, while the answer is still being generated
+    """
+    await websocket.accept()
+    try:
+        auth = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+        if auth.get("type") != "auth":
+            raise ValueError("expected an auth frame")
+        current_user = await user_from_token(str(auth.get("token") or ""))
+    except (HTTPException, ValueError, AttributeError, KeyError, asyncio.TimeoutError):
+        await close_with_error(websocket, 1008, {"type": "error", "detail": "Could not validate credentials"})
+        return
+    except WebSocketDisconnect:
+        return
+    customer_info = current_user.as_customer_info()
+    send_lock = asyncio.Lock()
+
+    async def send_json(payload):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+
+    async def send_bytes(data):
+        async with send_lock:
+            await websocket.send_bytes(data)
+
+    async def transcribe_segment(audio):
+        with stage("stt"):
+            text = (await stt_executor.run(stt.transcribe, audio)).text.strip()
+        if text:
+            await send_json({"type": "transcript_partial", "text": text})
+        return text
+
+    async def respond(user_text):
+        # Each sentence starts synthesizing as soon as it is complete (overlapping LLM generation and
+        # the previous sentences); the speaker sends the audio in order
+        sentences = asyncio.Queue()
+
+        async def speak():
+            while (synthesis := await sentences.get()) is not None:
+                with stage("tts_wait"):
+                    audio = await synthesis
+                await send_bytes(audio)
+
+        speaker = asyncio.create_task(speak())
+        chunker = SentenceChunker()
+        response_text = ""
+        try:
+            async for token_text in stream_query(user_text, customer_info, True, thread_id):
+                response_text += token_text
+                await send_json({"type": "token", "text": token_text})
+                for sentence in chunker.feed(token_text):
+                    sentences.put_nowait(asyncio.create_task(tts.sentence(sentence)))
+            rest = chunker.flush()
+            if rest:
+                sentences.put_nowait(asyncio.create_task(tts.sentence(rest)))
+            sentences.put_nowait(None)
+            await speaker
+        finally:
+            speaker.cancel()
+            while not sentences.empty():
+                synthesis = sentences.get_nowait()
+                if synthesis is not None:
+                    synthesis.cancel()
+        await send_json({"type": "done", "response_text": response_text})
+
+    segmenter = SpeechSegmenter()
+    pending = []
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                # Frames are buffered here; every VAD_CHECK_INTERVAL_MS of audio the VAD pool looks for pauses,
+                # and closed segments start transcribing while the user keeps talking
+                if segmenter.append(message["bytes"]):
+                    for segment in await vad_executor.run(segmenter.segments):
+                        pending.append(asyncio.create_task(transcribe_segment(segment)))
+                continue
+            if json.loads(message.get("text") or "{}").get("type") != "end":
+                continue
+
+            last = await vad_executor.run(segmenter.flush)
+            if last is not None:
+                pending.append(asyncio.create_task(transcribe_segment(last)))
+            parts = await asyncio.gather(*pending)
+            pending = []
+            user_text = " ".join(p for p in parts if p) or "[No speech detected]"
+            await send_json({"type": "transcript", "text": user_text})
+            await respond(user_text)
+    except WebSocketDisconnect:
+        pass
+    except ExecutorBusy as e:
+        await close_with_error(websocket, 1013, {"type": "error", "detail": f"Server busy ({e.name}), please retry", "retry_after": e.retry_after})
+    except Exception as e:
+        print(f"ERROR in voice_ws: {str(e)}")
+        await close_with_error(websocket, 1011, {"type": "error", "detail": str(e)})
     finally:
-        # Cleanup input file to save space
-        if os.path.exists(input_path):
-            try:
-                os.remove(input_path)
-            except:
-                pass
-
-# Initialization for models
-model_size = "base"
-stt_model = WhisperModel(model_size, device="cpu", compute_type="int8")
-UPLOAD_DIR = "temp_audio"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-@app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    return FileResponse(os.path.join(UPLOAD_DIR, filename))
+        for task in pending:
+            task.cancel()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics_response()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/metrics/executors")
+async def executors_metrics():
+    return executor_stats()
+
+@app.get("/metrics/stt")
+async def stt_metrics():
+    return stt.stats()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return {"advisory_semantic_cache": advisory_cache.stats(), "query_embeddings": embedding_service.stats(), "user_cache": user_cache.stats(), "token_cache": token_verifier.stats(), "tool_memo": tool_pool.memo.stats(), "tts": tts.stats()}
 
 @app.get("/health")
 def health():
+    # Liveness: the process is up and serving (may still be warming up)
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    # Readiness: route traffic here only once the agents (and Whisper) are warm and an MCP worker is up
+    warmed = WARMUP_MODE == "lazy" or (warmup_state["agents"] and warmup_state["stt"])
+    workers = tool_pool.stats()
+    tools_up = WARMUP_MODE == "lazy" or any(w["healthy"] for w in workers)
+    body = {
+        "status": "ready" if warmed and tools_up else "warming",
+        "mode": WARMUP_MODE,
+        "agents": warmup_state["agents"],
+        "stt": stt.stats()["loaded"],
+        "mcp_workers_healthy": sum(1 for w in workers if w["healthy"]),
+        "error": warmup_state["error"],
+    }
+    return JSONResponse(status_code=200 if warmed and tools_up else 503, content=body)
+
 if __name__ == "__main__":
+    # Development server; production runs gunicorn with gunicorn.conf.py (several workers)
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), workers=int(os.getenv("WEB_CONCURRENCY", "1")))
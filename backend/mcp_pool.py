@@ -0,0 +1,313 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import sys
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool, ToolException
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from database import MULTI_WORKER
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Transport config
+# stdio: spawn MCP_POOL_SIZE local mcp_server.py processes, each with one persistent session
+# streamable_http: open MCP_POOL_SIZE sessions spread over MCP_HTTP_URLS (servers started with MCP_TRANSPORT=streamable_http)
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio").replace("-", "_")
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "2" if MULTI_WORKER else "4"))
+MCP_HTTP_URLS = [url.strip() for url in os.getenv("MCP_HTTP_URLS", "http://localhost:8001/mcp").split(",") if url.strip()]
+MCP_HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "15"))
+MCP_PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT", "5"))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "60"))
+
+# Write tools that take an idempotency_key: the wrapper derives it from the chat turn and the arguments,
+# so a model retrying the same call within one turn can't post it twice
+IDEMPOTENT_TOOLS = {"transfer_funds"}
+
+# Read-only tools: within one chat turn, identical calls (same arguments) are made once and share the result,
+# including calls the model requests in parallel. Every other tool is a write and clears the turn's memo.
+READ_ONLY_TOOLS = {"get_customer_profile", "get_account_balance", "get_transaction_history", "query_policy_rag", "validate_transaction_fraud"}
+TOOL_MEMO_ENABLED = os.getenv("TOOL_MEMO_ENABLED", "true").lower() == "true"
+# Turns whose memo is kept; the oldest is dropped first (a memo is only useful while its turn runs)
+TOOL_MEMO_MAX_TURNS = int(os.getenv("TOOL_MEMO_MAX_TURNS", "1024"))
+
+def idempotency_key_for(turn_id: str, name: str, arguments: Dict) -> str:
+    payload = json.dumps([turn_id, name, arguments], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class TurnMemo:
+    """Results of read-only tool calls, per chat turn and call (name + arguments)."""
+
+    def __init__(self, max_turns: int = TOOL_MEMO_MAX_TURNS):
+        self.max_turns = max_turns
+        self._turns = OrderedDict()  # turn_id -> {call key: Task}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def call(self, turn_id: str, name: str, arguments: Dict, run: Callable[[], Awaitable]):
+        calls = self._turns.get(turn_id)
+        if calls is None:
+            calls = self._turns[turn_id] = {}
+            while len(self._turns) > self.max_turns:
+                self._turns.popitem(last=False)
+        key = json.dumps([name, arguments], sort_keys=True, default=str)
+        task = calls.get(key)
+        if task is None:
+            self.misses += 1
+            task = calls[key] = asyncio.create_task(self._run(calls, key, run))
+        elif task.done():
+            self.hits += 1
+        else:
+            self.coalesced += 1
+        # shield: a cancelled caller must not cancel the call other callers are waiting on
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _run(calls: Dict, key: str, run: Callable[[], Awaitable]):
+        try:
+            return await run()
+        except BaseException:
+            # Failures are not memoized: the next identical call tries again
+            if calls.get(key) is asyncio.current_task():
+                del calls[key]
+            raise
+
+    def invalidate(self, turn_id: str):
+        """After a write: later reads in the turn must see its effect."""
+        if self._turns.pop(turn_id, None):
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "turns": len(self._turns),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_PATH = os.path.join(BACKEND_DIR, "mcp_server.py")
+
+def worker_connections() -> List[Dict]:
+    if MCP_TRANSPORT == "stdio":
+        return [{
+            "transport": "stdio",
+            "command": sys.executable,
+            "args": [SERVER_PATH],
+            "env": dict(os.environ),
+            "cwd": BACKEND_DIR,
+        } for _ in range(MCP_POOL_SIZE)]
+    if MCP_TRANSPORT == "streamable_http":
+        return [{
+            "transport": "streamable_http",
+            "url": MCP_HTTP_URLS[i % len(MCP_HTTP_URLS)],
+        } for i in range(max(MCP_POOL_SIZE, len(MCP_HTTP_URLS)))]
+    raise ValueError(f"Unsupported MCP_TRANSPORT: {MCP_TRANSPORT}")
+
+class MCPWorker:
+    """One persistent MCP session (and, for stdio, one server process)."""
+
+    def __init__(self, index: int, connection: Dict):
+        self.index = index
+        self.connection = connection
+        self.session = None
+        self.tools = {}
+        self.healthy = False
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self._task = None
+        self._ready = None
+        self._closing = None
+
+    async def start(self):
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        # The session lives in its own task: anyio cancel scopes must be exited by the task that entered them
+        self._task = asyncio.create_task(self._run())
+        ready = asyncio.create_task(self._ready.wait())
+        await asyncio.wait({ready, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not self._ready.is_set():
+            ready.cancel()
+            self._task.result()  # re-raise the startup error
+        self.healthy = True
+
+    async def _run(self):
+        client = MultiServerMCPClient({"banking": self.connection})
+        try:
+            async with client.session("banking") as session:
+                self.session = session
+                self.tools = {t.name: t for t in await load_mcp_tools(session)}
+                self._ready.set()
+                await self._closing.wait()
+        finally:
+            self.healthy = False
+            self.session = None
+
+    async def stop(self):
+        self.healthy = False
+        if self._task is None:
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=MCP_PING_TIMEOUT)
+        except BaseException:
+            self._task.cancel()
+        self._task = None
+
+    def alive(self) -> bool:
+        return self.healthy and self._task is not None and not self._task.done()
+
+    async def ping(self) -> bool:
+        if not self.alive():
+            return False
+        if self.in_flight:
+            # A busy server may not answer pings until its current tool returns; MCP_CALL_TIMEOUT covers hangs
+            return True
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=MCP_PING_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def call(self, name: str, arguments: Dict):
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self.tools[name].coroutine(**arguments), timeout=MCP_CALL_TIMEOUT)
+        except ToolException:
+            # Tool-level errors are answers for the model, not a sign of a broken worker
+            raise
+        except Exception:
+            self.failures += 1
+            self.healthy = False
+            raise
+        finally:
+            self.in_flight -= 1
+
+class MCPToolPool:
+    """Load-balances tool calls over a pool of MCP workers, with health checks and automatic respawn."""
+
+    def __init__(self, connections: List[Dict]):
+        self.workers = [MCPWorker(i, conn) for i, conn in enumerate(connections)]
+        self.restarts = 0
+        self._tools = []
+        self._round_robin = itertools.count()
+        self._health_task = None
+        self._respawning = set()
+        self.memo = TurnMemo()
+
+    async def start(self):
+        results = await asyncio.gather(*(w.start() for w in self.workers), return_exceptions=True)
+        started = [w for w, r in zip(self.workers, results) if not isinstance(r, BaseException)]
+        if not started:
+            raise RuntimeError(f"Could not start any MCP worker: {results[0]}")
+        for worker, result in zip(self.workers, results):
+            if isinstance(result, BaseException):
+                print(f"WARNING: MCP worker {worker.index} failed to start: {result}")
+        self._tools = [self._make_tool(t) for t in started[0].tools.values()]
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(w.stop() for w in self.workers), return_exceptions=True)
+
+    def tools(self) -> List[StructuredTool]:
+        return self._tools
+
+    def stats(self) -> List[Dict]:
+        return [{
+            "worker": w.index,
+            "healthy": w.alive(),
+            "in_flight": w.in_flight,
+            "calls": w.calls,
+            "failures": w.failures,
+        } for w in self.workers]
+
+    def _pick(self) -> MCPWorker:
+        healthy = [w for w in self.workers if w.alive()]
+        for worker in self.workers:
+            if not worker.alive():
+                self._schedule_respawn(worker)
+        if not healthy:
+            raise RuntimeError("No healthy MCP workers available")
+        # Least in-flight calls first; round robin breaks ties so idle workers share the load
+        offset = next(self._round_robin)
+        return min(healthy, key=lambda w: (w.in_flight, (w.index - offset) % len(self.workers)))
+
+    async def call(self, name: str, arguments: Dict):
+        return await self._pick().call(name, arguments)
+
+    def _make_tool(self, template: StructuredTool) -> StructuredTool:
+        name = template.name
+        schema = template.args_schema if isinstance(template.args_schema, dict) else template.args_schema.model_json_schema()
+        takes_customer_id = "customer_id" in schema.get("properties", {})
+
+        async def call_tool(config: RunnableConfig, **arguments):
+            configurable = config.get("configurable") or {}
+            turn_id = configurable.get("turn_id")
+            # The authenticated caller, set by agents.graph_for: the model can't act on another customer's data
+            if takes_customer_id and configurable.get("customer_id") is not None:
+                arguments["customer_id"] = configurable["customer_id"]
+            if name in IDEMPOTENT_TOOLS and turn_id:
+                arguments.pop("idempotency_key", None)
+                arguments["idempotency_key"] = idempotency_key_for(turn_id, name, arguments)
+            if not turn_id:
+                return await self.call(name, arguments)
+            if name in READ_ONLY_TOOLS:
+                if TOOL_MEMO_ENABLED:
+                    return await self.memo.call(turn_id, name, arguments, lambda: self.call(name, arguments))
+                return await self.call(name, arguments)
+            try:
+                return await self.call(name, arguments)
+            finally:
+                self.memo.invalidate(turn_id)
+
+        return StructuredTool(
+            name=name,
+            description=template.description,
+            args_schema=template.args_schema,
+            coroutine=call_tool,
+            response_format="content_and_artifact",
+            metadata=template.metadata,
+            handle_tool_error=True,
+        )
+
+    def _schedule_respawn(self, worker: MCPWorker):
+        if worker.index not in self._respawning:
+            self._respawning.add(worker.index)
+            asyncio.create_task(self._respawn(worker))
+
+    async def _respawn(self, worker: MCPWorker):
+        try:
+            await worker.stop()
+            await worker.start()
+            self.restarts += 1
+            print(f"MCP worker {worker.index} respawned")
+        except Exception as e:
+            print(f"WARNING: MCP worker {worker.index} respawn failed: {e}")
+        finally:
+            self._respawning.discard(worker.index)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(MCP_HEALTH_INTERVAL)
+            results = await asyncio.gather(*(w.ping() for w in self.workers))
+            for worker, ok in zip(self.workers, results):
+                if not ok:
+                    worker.healthy = False
+                    self._schedule_respawn(worker)
+
+tool_pool = MCPToolPool(worker_connections())
@@ -1,82 +1,100 @@
 from fastmcp import FastMCP
-from sqlalchemy.orm import Session
-from database import SessionLocal, Customer, Account, Transaction, Application, PolicyVector
+from sqlalchemy import select
+from database import AsyncSessionLocal, Customer, Account, Application
+import sys
 import uuid
 from typing import Dict, List, Optional
 import json
 import os
-from langchain_ollama import OllamaEmbeddings
+from embedding_service import embedding_service
+from retrieval import hybrid_search
+from user_cache import user_cache
+import transfers
+import history
+from contextlib import asynccontextmanager
+from fraud import fraud_engine
+from notifications import hub
 
-mcp = FastMCP("BankingService")
+@asynccontextmanager
+async def lifespan(server):
+    # Build the fraud profiles before the first tool call instead of inside it
+    try:
+        await fraud_engine.ensure_ready()
+    except Exception as e:
+        # stdout carries the MCP stdio protocol: everything this process logs goes to stderr
+        print(f"Fraud engine warm-up failed, retrying on first use: {e}", file=sys.stderr)
+    try:
+        yield {}
+    finally:
+        await hub.close()
+
+mcp = FastMCP("BankingService", lifespan=lifespan)
 
 @mcp.tool()
-def get_customer_profile(email: str) -> Dict:
+async def get_customer_profile(email: str) -> Dict:
     """Retrieves customer profile by email."""
-    db = SessionLocal()
-    try:
-        customer = db.query(Customer).filter(Customer.email == email).first()
-        if customer:
-            return {
-                "id": customer.id,
-                "name": customer.full_name,
-                "address": customer.address,
-                "is_authenticated": customer.is_authenticated
-            }
-        return {"error": "Customer not found"}
-    finally:
-        db.close()
+    customer = await user_cache.get_customer(email)
+    if customer:
+        return {
+            "id": customer.id,
+            "name": customer.full_name,
+            "address": customer.address,
+            "is_authenticated": customer.is_authenticated
+        }
+    return {"error": "Customer not found"}
 
 @mcp.tool()
-def get_account_balance(customer_id: Optional[int] = None, email: Optional[str] = None) -> List[Dict]:
-    """Checks balances for all accounts owned by a customer using ID or email."""
-    db = SessionLocal()
-    try:
-        if email:
-            customer = db.query(Customer).filter(Customer.email == email).first()
-            if customer:
-                customer_id = customer.id
-            else:
-                return [{"error": "Customer email not found"}]
+async def get_account_balance(customer_id: Optional[int] = None, email: Optional[str] = None) -> List[Dict]:
+    """Checks balances for all accounts owned by a customer. Prefer the customer_id from the context; email is a fallback."""
+    if not customer_id and email:
+        customer = await user_cache.get_customer(email)
+        if customer:
+            customer_id = customer.id
+        else:
+            return [{"error": "Customer email not found"}]
+    
+    if not customer_id:
+        return [{"error": "No ID or email provided"}]
         
-        if not customer_id:
-            return [{"error": "No ID or email provided"}]
-            
-        accounts = db.query(Account).filter(Account.customer_id == customer_id).all()
-        return [{"account_number": acc.account_number, "type": acc.account_type, "balance": acc.balance} for acc in accounts]
-    finally:
-        db.close()
+    return await user_cache.get_accounts(customer_id)
 
 @mcp.tool()
-def transfer_funds(from_account: str, to_account: str, amount: float, description: str = "Transfer") -> str:
-    """Transfers funds between accounts and records transactions."""
-    db = SessionLocal()
-    try:
-        sender = db.query(Account).filter(Account.account_number == from_account).first()
-        receiver = db.query(Account).filter(Account.account_number == to_account).first()
-        
-        if not sender or not receiver:
-            return "Error: One or both accounts not found."
-        
-        if sender.balance < amount:
-            return "Error: Insufficient funds."
-        
-        sender.balance -= amount
-        receiver.balance += amount
-        
-        # Record transactions
-        db.add(Transaction(account_id=sender.id, amount=-amount, transaction_type="Debit", description=description))
-        db.add(Transaction(account_id=receiver.id, amount=amount, transaction_type="Credit", description=description))
-        
-        db.commit()
-        return f"Successfully transferred ${amount} from {from_account} to {to_account}."
-    except Exception as e:
-        db.rollback()
-        return f"Error: {str(e)}"
-    finally:
-        db.close()
+async def get_transaction_history(account_number: str, customer_id: int, limit: int = 10, cursor: Optional[str] = None) -> Dict:
+    """
+    Lists an account's transactions, newest first.
+
+    Args:
+        account_number: The customer's account to read.
+        customer_id: The customer_id from the context (the account must belong to this customer).
+        limit: How many transactions to return (default 10).
+        cursor: The next_cursor from a previous call, to get the following (older) page.
+    """
+    async with AsyncSessionLocal() as db:
+        account_id = await history.owned_account_id(db, account_number, customer_id)
+        if account_id is None:
+            return {"error": "Account not found for this customer."}
+        try:
+            return await history.get_page(db, account_id, limit, cursor)
+        except history.InvalidCursor:
+            return {"error": "Invalid cursor; call again without it to start from the newest transactions."}
+
+@mcp.tool()
+async def transfer_funds(from_account: str, to_account: str, amount: float, customer_id: int, description: str = "Transfer", idempotency_key: Optional[str] = None) -> str:
+    """
+    Transfers funds between accounts and records transactions.
+    
+    Args:
+        from_account: Account number to debit (must belong to the customer).
+        to_account: Account number to credit.
+        amount: Amount to transfer (at most 2 decimal places).
+        customer_id: The customer_id from the context.
+        description: Short description stored on both transactions.
+        idempotency_key: Leave empty; it is set automatically so a retried call is not posted twice.
+    """
+    return await transfers.transfer_funds(from_account, to_account, amount, description, idempotency_key, customer_id)
 
 @mcp.tool()
-def apply_for_product(product_type: str, details: Optional[Dict] = None, customer_id: Optional[int] = None, email: Optional[str] = None) -> str:
+async def apply_for_product(product_type: str, details: Optional[Dict] = None, customer_id: Optional[int] = None, email: Optional[str] = None) -> str:
     """
     Submits an application for account opening, loan, credit card, or insurance.
     
@@ -88,66 +106,72 @@ def apply_for_product(product_type: str, details: Optional[Dict] = None, custome
     """
     if details is None:
         details = {}
-    db = SessionLocal()
-    try:
-        # If customer_id is missing, try to find or create a placeholder for the application
-        if not customer_id:
-            if not email:
-                return "Error: Either customer_id or email must be provided for an application."
+    async with AsyncSessionLocal() as db:
+        try:
+            # If customer_id is missing, try to find or create a placeholder for the application
+            if not customer_id:
+                if not email:
+                    return "Error: Either customer_id or email must be provided for an application."
+                
+                customer = (await db.execute(select(Customer).where(Customer.email == email))).scalars().first()
+                if customer:
+                    customer_id = customer.id
+                else:
+                    # Create a minimal customer entry for the application if name is in details
+                    full_name = details.get("full_name", "Unknown Applicant")
+                    new_customer = Customer(full_name=full_name, email=email)
+                    db.add(new_customer)
+                    await db.flush() # Get the ID
+                    customer_id = new_customer.id
             
-            customer = db.query(Customer).filter(Customer.email == email).first()
-            if customer:
-                customer_id = customer.id
-            else:
-                # Create a minimal customer entry for the application if name is in details
-                full_name = details.get("full_name", "Unknown Applicant")
-                new_customer = Customer(full_name=full_name, email=email)
-                db.add(new_customer)
-                db.flush() # Get the ID
-                customer_id = new_customer.id
-        
-        application = Application(
-            customer_id=customer_id,
-            type=product_type,
-            details=json.dumps(details)
-        )
-        db.add(application)
-        db.commit()
-        return f"Application for {product_type} submitted successfully. Status: Pending. Reference ID: {application.id or 'N/A'}"
-    except Exception as e:
-        db.rollback()
-        return f"Error submitting application: {str(e)}"
-    finally:
-        db.close()
+            application = Application(
+                customer_id=customer_id,
+                type=product_type,
+                details=json.dumps(details)
+            )
+            db.add(application)
+            await user_cache.invalidate(db, customer_id=customer_id, email=email)
+            await db.commit()
+            return f"Application for {product_type} submitted successfully. Status: Pending. Reference ID: {application.id or 'N/A'}"
+        except Exception as e:
+            await db.rollback()
+            return f"Error submitting application: {str(e)}"
 
 @mcp.tool()
-def update_customer_address(customer_id: int, new_address: str) -> str:
+async def update_customer_address(customer_id: int, new_address: str) -> str:
     """Updates the customer's physical address."""
-    db = SessionLocal()
-    try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    async with AsyncSessionLocal() as db:
+        customer = (await db.execute(select(Customer).where(Customer.id == customer_id))).scalars().first()
         if customer:
             customer.address = new_address
-            db.commit()
+            await user_cache.invalidate(db, customer_id=customer.id, email=customer.email)
+            await db.commit()
             return "Address updated successfully."
         return "Error: Customer not found."
-    finally:
-        db.close()
 
 @mcp.tool()
-def validate_transaction_fraud(account_id: int, amount: float) -> Dict:
-    """Checks if a transaction is potentially fraudulent and triggers alerts."""
-    # Mock logic for buildathon: transactions > 5000 are "flagged"
-    if amount > 5000:
-        return {
-            "status": "Flagged",
-            "reason": "High value transaction",
-            "action_required": "Email confirmation sent to customer as per policy."
-        }
-    return {"status": "Clean", "reason": "Normal transaction pattern"}
+async def validate_transaction_fraud(amount: float, customer_id: int, account_id: Optional[int] = None, account_number: Optional[str] = None, counterparty_account: Optional[str] = None) -> Dict:
+    """
+    Checks if a planned payment from an account is potentially fraudulent and triggers alerts.
+
+    Args:
+        amount: The payment amount.
+        customer_id: The customer_id from the context (the paying account must belong to this customer).
+        account_id / account_number: The paying account (either one).
+        counterparty_account: The receiving account number, if known.
+    """
+    await fraud_engine.ensure_ready()
+    if account_id is not None or account_number:
+        owned = select(Account.id).where(Account.customer_id == customer_id)
+        owned = owned.where(Account.id == account_id) if account_id is not None else owned.where(Account.account_number == account_number)
+        async with AsyncSessionLocal() as db:
+            account_id = (await db.execute(owned)).scalar()
+    if account_id is None:
+        return {"status": "Error", "reason": "Account not found."}
+    return fraud_engine.score(account_id, abs(amount), counterparty_account).as_dict()
 
 @mcp.tool()
-def query_policy_rag(search_query: str) -> str:
+async def query_policy_rag(search_query: str) -> str:
     """
     Search the bank's policy documentation (ACH, Cheque clearing, etc.) for answers.
     Use this for questions about how things work or bank rules.
@@ -162,27 +186,23 @@ def query_policy_rag(search_query: str) -> str:
     if not search_query:
         return "Please provide a specific query about bank policies."
     
-    db = SessionLocal()
-    try:
-        # Use the same Ollama embeddings as used in seed_rag.py
-        embeddings = OllamaEmbeddings(
-            model=os.getenv("MODEL_NAME", "llama3.2"),
-            base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-        )
-        
-        # 1. Embed the query
-        query_vector = embeddings.embed_query(str(search_query))
-        
-        # 2. Search database
-        results = db.query(PolicyVector).order_by(PolicyVector.embedding.l2_distance(query_vector)).limit(3).all()
+    # 1. Embed the query (same Ollama model as seed_rag.py; cached and coalesced per process)
+    query_vector = await embedding_service.embed(str(search_query))
+    
+    # 2. Search database: full-text (exact terms like "ACH") + HNSW vector search, fused and optionally reranked
+    async with AsyncSessionLocal() as db:
+        results = await hybrid_search(db, str(search_query), query_vector, k=3)
+    
+    if not results:
+        return "No specific policy found matching that query."
         
-        if not results:
-            return "No specific policy found matching that query."
-            
-        context = "\n---\n".join([r.content for r in results])
-        return f"Policy Results:\n{context}"
-    finally:
-        db.close()
+    context = "\n---\n".join([r.content for r in results])
+    return f"Policy Results:\n{context}"
 
 if __name__ == "__main__":
-    mcp.run()
+    # stdio when spawned by the API's worker pool; streamable_http to serve MCP_HTTP_URLS clients
+    transport = os.getenv("MCP_TRANSPORT", "stdio").replace("-", "_")
+    if transport == "streamable_http":
+        mcp.run(transport="streamable-http", host=os.getenv("MCP_HOST", "0.0.0.0"), port=int(os.getenv("MCP_PORT", "8001")))
+    else:
+        mcp.run()
@@ -0,0 +1,92 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+from langchain_core.messages import BaseMessage, HumanMessage, get_buffer_string
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.checkpoint.memory import InMemorySaver
+from database import DATABASE_URL, MULTI_WORKER
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Conversation memory: "postgres" persists threads across restarts and workers, "memory" is in-process (tests/dev)
+CHECKPOINTER = os.getenv("CHECKPOINTER", "postgres").lower()
+CHECKPOINT_POOL_SIZE = int(os.getenv("CHECKPOINT_POOL_SIZE", "2" if MULTI_WORKER else "5"))
+# Once a thread's messages exceed the budget, older turns are folded away until CONTEXT_KEEP_TOKENS remain
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_KEEP_TOKENS = int(os.getenv("CONTEXT_KEEP_TOKENS", str(CONTEXT_TOKEN_BUDGET // 2)))
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "summarize").lower() # summarize | trim
+# Tag on the summarization LLM call, so its tokens are not streamed to the client as part of the answer
+SUMMARY_TAG = "context_summary"
+
+_checkpointer = None
+_pool = None
+_lock = asyncio.Lock()
+
+async def get_checkpointer():
+    global _checkpointer, _pool
+    if _checkpointer is not None:
+        return _checkpointer
+    async with _lock:
+        if _checkpointer is None:
+            if CHECKPOINTER == "postgres":
+                from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+                from psycopg.rows import dict_row
+                from psycopg_pool import AsyncConnectionPool
+                _pool = AsyncConnectionPool(
+                    conninfo=DATABASE_URL,
+                    max_size=CHECKPOINT_POOL_SIZE,
+                    kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+                    open=False,
+                )
+                await _pool.open()
+                saver = AsyncPostgresSaver(_pool)
+                await saver.setup()
+                _checkpointer = saver
+            else:
+                _checkpointer = InMemorySaver()
+    return _checkpointer
+
+async def close_checkpointer():
+    global _checkpointer, _pool
+    if _pool is not None:
+        await _pool.close()
+    _checkpointer = None
+    _pool = None
+
+def thread_id_for(customer_info: Dict, thread_id: Optional[str] = None) -> Optional[str]:
+    """Conversation threads are namespaced by customer, so a client-chosen thread id can't reach another user's."""
+    if not customer_info.get("id"):
+        return None
+    base = f"customer-{customer_info['id']}"
+    return f"{base}:{thread_id}" if thread_id else base
+
+def fold_point(messages: List[BaseMessage]) -> int:
+    """
+    Index of the first message to keep once the thread is over CONTEXT_TOKEN_BUDGET (0 = keep everything).
+    The kept window always starts at a user turn, so tool calls are never separated from their results.
+    """
+    if count_tokens_approximately(messages) <= CONTEXT_TOKEN_BUDGET:
+        return 0
+    kept = 0
+    start = len(messages)
+    while start > 0 and kept + count_tokens_approximately([messages[start - 1]]) <= CONTEXT_KEEP_TOKENS:
+        start -= 1
+        kept += count_tokens_approximately([messages[start]])
+    for i in range(start, len(messages)):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    # A single oversized turn: keep at least the latest user message
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    return 0
+
+def summary_prompt(summary: str, messages: List[BaseMessage]) -> str:
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return (
+        "You maintain the running summary of a conversation between a bank customer and a banking assistant.\n"
+        "Keep account numbers, amounts, names, decisions and any unfinished requests; drop small talk. "
+        "Answer with the updated summary only, in at most 150 words.\n\n"
+        f"{previous}New messages:\n{get_buffer_string(messages)}"
+    )
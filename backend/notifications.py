@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import sys
+from typing import Callable, Dict, List, Optional
+import asyncpg
+from sqlalchemy import text
+from database import DATABASE_URL
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A listener that can't connect retries in the background, backing off from the first delay to the max
+NOTIFY_RETRY_SECONDS = float(os.getenv("NOTIFY_RETRY_SECONDS", "1"))
+NOTIFY_RETRY_MAX_SECONDS = float(os.getenv("NOTIFY_RETRY_MAX_SECONDS", "60"))
+
+async def notify(db, channel: str, payload: Dict):
+    """Queues a Postgres NOTIFY on the session's transaction: listeners only receive it if the transaction commits."""
+    await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": json.dumps(payload)})
+
+class NotificationHub:
+    """
+    One LISTEN connection per process, shared by every in-memory structure that has to follow writes
+    made by other processes (the API and each MCP worker).
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[Dict], None]]] = {}
+        self._reset_handlers: List[Callable[[], None]] = []
+        self._connection = None
+        self._lock = None
+        self._retry_task = None
+
+    def subscribe(self, channel: str, handler: Callable[[Dict], None], on_reset: Optional[Callable[[], None]] = None):
+        """
+        handler gets each decoded payload. on_reset runs when notifications may have been missed
+        (listener lost, or a payload could not be decoded), so local state can be dropped or rebuilt.
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+        if on_reset is not None:
+            self._reset_handlers.append(on_reset)
+        if self._connection:
+            asyncio.ensure_future(self._connection.add_listener(channel, self._dispatch))
+
+    @property
+    def listening(self) -> bool:
+        return bool(self._connection)
+
+    async def start(self):
+        if self._connection is not None or self._retry_task is not None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._connection is not None or self._retry_task is not None:
+                return
+            if not await self._connect():
+                # Meanwhile subscribers fall back to their own staleness bounds (TTLs, periodic rebuilds)
+                self._retry_task = asyncio.create_task(self._retry())
+
+    async def _connect(self) -> bool:
+        connection = None
+        try:
+            connection = await asyncpg.connect(DATABASE_URL)
+            for channel in self._handlers:
+                await connection.add_listener(channel, self._dispatch)
+            connection.add_termination_listener(self._on_lost)
+            self._connection = connection
+            return True
+        except Exception as e:
+            print(f"Notification listener unavailable: {e}", file=sys.stderr)
+            if connection is not None:
+                connection.terminate()
+            return False
+
+    async def _retry(self):
+        delay = NOTIFY_RETRY_SECONDS
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                if await self._connect():
+                    # Writes made while nobody was listening were missed
+                    self._reset()
+                    return
+                delay = min(delay * 2, NOTIFY_RETRY_MAX_SECONDS)
+        finally:
+            self._retry_task = None
+
+    def _dispatch(self, connection, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            self._reset()
+            return
+        for handler in self._handlers.get(channel, []):
+            handler(data)
+
+    def _on_lost(self, connection):
+        print("Notification listener disconnected; resetting subscribers", file=sys.stderr)
+        self._connection = None
+        self._reset()
+
+    def _reset(self):
+        for on_reset in self._reset_handlers:
+            on_reset()
+
+    async def close(self):
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        if self._connection:
+            self._connection.remove_termination_listener(self._on_lost)
+            await self._connection.close()
+        self._connection = None
+
+hub = NotificationHub()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+from typing import Dict, List
+from sqlalchemy import select, text, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import PolicyVector, TEXT_SEARCH_CONFIG
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# HNSW candidate list size at query time: higher = better recall, slower queries (pgvector default is 40)
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# Hybrid retrieval: each retriever contributes this many candidates to reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Optional cross-encoder reranker, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (empty = disabled)
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "10"))
+
+async def vector_search(db: AsyncSession, query_vector: List[float], k: int = 3, ef_search: int = HNSW_EF_SEARCH) -> List[PolicyVector]:
+    """Nearest policy chunks by L2 distance, served by the HNSW index on policy_vectors.embedding."""
+    # SET LOCAL only lasts until the end of this session's transaction
+    await db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    return (await db.execute(
+        select(PolicyVector).order_by(PolicyVector.embedding.l2_distance(query_vector)).limit(k)
+    )).scalars().all()
+
+async def lexical_search(db: AsyncSession, query: str, k: int = 3) -> List[PolicyVector]:
+    """Full-text match on policy_vectors.content_tsv (GIN index), ranked by cover density."""
+    # plainto_tsquery ANDs every term, which misses on conversational questions: OR the words instead,
+    # parsed and stemmed once by websearch_to_tsquery (stop words drop out)
+    words = [w for w in re.findall(r"\w+", query) if w.lower() != "or"]
+    tsquery = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, " or ".join(words))
+    return (await db.execute(
+        select(PolicyVector)
+        .where(PolicyVector.content_tsv.op("@@")(tsquery))
+        .order_by(func.ts_rank_cd(PolicyVector.content_tsv, tsquery).desc())
+        .limit(k)
+    )).scalars().all()
+
+def reciprocal_rank_fusion(*rankings: List[PolicyVector], k: int = RRF_K) -> List[PolicyVector]:
+    """Merges ranked lists by sum(1 / (k + rank)); documents found by both retrievers rise to the top."""
+    scores: Dict[int, float] = {}
+    documents: Dict[int, PolicyVector] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            scores[document.id] = scores.get(document.id, 0.0) + 1.0 / (k + rank)
+            documents[document.id] = document
+    return [documents[i] for i in sorted(scores, key=scores.get, reverse=True)]
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    """Loads the cross-encoder on first use (per process); returns None when disabled or unavailable."""
+    global _reranker, RERANKER_MODEL
+    if not RERANKER_MODEL:
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            try:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(RERANKER_MODEL, device="cpu")
+            except Exception as e:
+                print(f"Reranker {RERANKER_MODEL} unavailable, using fused ranking only: {e}", file=sys.stderr)
+                RERANKER_MODEL = ""
+                return None
+    return _reranker
+
+def rerank(query: str, documents: List[PolicyVector]) -> List[PolicyVector]:
+    reranker = get_reranker()
+    if reranker is None or len(documents) < 2:
+        return documents
+    scores = reranker.predict([(query, d.content) for d in documents])
+    return [d for _, d in sorted(zip(scores, documents), key=lambda pair: pair[0], reverse=True)]
+
+async def hybrid_search(db: AsyncSession, query: str, query_vector: List[float], k: int = 3, candidates: int = HYBRID_CANDIDATES) -> List[PolicyVector]:
+    """Lexical + vector retrieval fused with RRF, optionally reranked by a local cross-encoder."""
+    semantic = await vector_search(db, query_vector, k=candidates)
+    lexical = await lexical_search(db, query, k=candidates)
+    fused = reciprocal_rank_fusion(lexical, semantic)
+    if RERANKER_MODEL:
+        # CPU-bound inference: keep it off the event loop
+        head = await asyncio.to_thread(rerank, query, fused[:RERANK_CANDIDATES])
+        fused = head + fused[RERANK_CANDIDATES:]
+    return fused[:k]
@@ -1,53 +1,185 @@
-from langchain_ollama import OllamaEmbeddings
-from database import SessionLocal, PolicyVector, init_db
+"""
+Policy ingestion CLI.
+
+    python seed_rag.py                          # built-in sample policies
+    python seed_rag.py --dir ./policies         # every .md/.txt file under a directory
+    python seed_rag.py --dir ./policies --reset # drop and recreate all tables first
+    python seed_rag.py --dir ./policies --prune # also remove sources not in this run (deleted files, built-in samples)
+
+Documents are chunked, and each chunk is keyed by (source, sha256(content)). Re-running only embeds
+chunks that are new or changed, or were embedded with another EMBEDDING_BACKEND/MODEL/DIM/PROJECTION_SEED,
+deletes chunks that disappeared from a document, and writes with COPY.
+"""
+from embedding_service import embedding_fingerprint, embeddings_client, reduce_dimensions
+from database import SessionLocal, PolicyVector, init_db, create_tables
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, delete
+from typing import Dict, List
+import argparse
+import csv
+import hashlib
+import io
 import json
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def seed_policies():
-    db = SessionLocal()
-    # Use Ollama for embeddings - much lighter than local sentence-transformers
-    embeddings = OllamaEmbeddings(
-        model=os.getenv("MODEL_NAME", "llama3.2"),
-        base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1200")) # characters
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "150"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+DOCUMENT_EXTENSIONS = (".md", ".txt")
+
+DEFAULT_POLICIES = [
+    {
+        "content": "Cheque Clearing Policy: Domestic cheques usually clear within 2 business days. Individual banks may hold funds for up to 5 days for larger amounts.",
+        "metadata": {"category": "Cheque Clearing"}
+    },
+    {
+        "content": "ACH Clearing Policy: Standard ACH transfers take 1-3 business days. Same-day ACH is available for most transactions submitted before 10 AM.",
+        "metadata": {"category": "ACH"}
+    },
+    {
+        "content": "Fraud Prevention: We use AI-based monitoring. If a transaction is flagged as high-risk, we will send an email alert and hold the process until confirmed.",
+        "metadata": {"category": "Security"}
+    }
+]
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def chunk_text(text: str, max_chars: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Packs paragraphs into chunks of up to max_chars; oversized paragraphs are split with overlap."""
+    chunks, current = [], ""
+    for paragraph in [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]:
+        if len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            step = max_chars - overlap
+            chunks.extend(paragraph[i:i + max_chars] for i in range(0, len(paragraph) - overlap, step))
+        elif len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def load_documents(directory: str) -> List[Dict]:
+    documents = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(DOCUMENT_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            source = os.path.relpath(path, directory)
+            with open(path, encoding="utf-8") as f:
+                documents.append({
+                    "source": source,
+                    "chunks": chunk_text(f.read()),
+                    "metadata": {"category": os.path.splitext(name)[0], "source": source},
+                })
+    return documents
+
+def builtin_documents() -> List[Dict]:
+    return [{
+        "source": "builtin",
+        "chunks": [p["content"] for p in DEFAULT_POLICIES],
+        "metadata": [p["metadata"] for p in DEFAULT_POLICIES],
+    }]
+
+def embed_batches(texts: List[str], batch_size: int, concurrency: int) -> List[List[float]]:
+    """embed_documents in batches, with at most `concurrency` batches in flight; keeps input order."""
+    embeddings = embeddings_client()
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    vectors = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for done, batch_vectors in enumerate(pool.map(embeddings.embed_documents, batches), start=1):
+            vectors.extend(reduce_dimensions(v) for v in batch_vectors)
+            print(f"Embedded batch {done}/{len(batches)}")
+    return vectors
+
+def copy_rows(db, rows: List[Dict]):
+    # COPY is the fastest bulk path into Postgres; csv handles quoting of the chunk text
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row["source"], row["content_hash"], row["embedding_fingerprint"], row["content"], row["metadata_json"], "[" + ",".join(map(str, row["embedding"])) + "]"])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(
+        "COPY policy_vectors (source, content_hash, embedding_fingerprint, content, metadata_json, embedding) FROM STDIN WITH (FORMAT csv)",
+        buffer,
     )
-    
-    policies = [
-        {
-            "content": "Cheque Clearing Policy: Domestic cheques usually clear within 2 business days. Individual banks may hold funds for up to 5 days for larger amounts.",
-            "metadata": {"category": "Cheque Clearing"}
-        },
-        {
-            "content": "ACH Clearing Policy: Standard ACH transfers take 1-3 business days. Same-day ACH is available for most transactions submitted before 10 AM.",
-            "metadata": {"category": "ACH"}
-        },
-        {
-            "content": "Fraud Prevention: We use AI-based monitoring. If a transaction is flagged as high-risk, we will send an email alert and hold the process until confirmed.",
-            "metadata": {"category": "Security"}
-        }
-    ]
-    
-    # Simple check to avoid duplicate seeding
-    if db.query(PolicyVector).count() > 0:
-        print("Policies already seeded.")
-        return
-
-    for p in policies:
-        # langchain-ollama returns embeddings via embed_query
-        embedding = embeddings.embed_query(p["content"])
-        policy = PolicyVector(
-            content=p["content"],
-            metadata_json=json.dumps(p["metadata"]),
-            embedding=embedding
-        )
-        db.add(policy)
-    
-    db.commit()
-    db.close()
+
+def ingest(documents: List[Dict], batch_size: int = EMBED_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY, prune: bool = False):
+    """prune: the documents are the whole corpus, so chunks of any other source are removed too."""
+    db = SessionLocal()
+    try:
+        sources = [d["source"] for d in documents]
+        fingerprint = embedding_fingerprint()
+        query = select(PolicyVector.id, PolicyVector.source, PolicyVector.content_hash, PolicyVector.embedding_fingerprint)
+        if not prune:
+            query = query.where(PolicyVector.source.in_(sources))
+        existing, outdated_ids = {}, []
+        for row in db.execute(query):
+            if row.embedding_fingerprint == fingerprint:
+                existing[(row.source, row.content_hash)] = row.id
+            else:
+                outdated_ids.append(row.id) # embedded in another space: deleted, and re-embedded if still present
+
+        new_rows, keep = [], set()
+        for document in documents:
+            for i, chunk in enumerate(document["chunks"]):
+                key = (document["source"], content_hash(chunk))
+                if key in existing:
+                    keep.add(key)
+                    continue
+                if key in keep:
+                    continue # duplicate chunk within the same document
+                keep.add(key)
+                metadata = document["metadata"][i] if isinstance(document["metadata"], list) else document["metadata"]
+                new_rows.append({"source": key[0], "content_hash": key[1], "embedding_fingerprint": fingerprint, "content": chunk, "metadata_json": json.dumps(metadata)})
+
+        stale_ids = [row_id for key, row_id in existing.items() if key not in keep] + outdated_ids
+        print(f"{len(new_rows)} new/changed chunks, {len(keep) - len(new_rows)} unchanged, {len(stale_ids)} removed")
+
+        if new_rows:
+            vectors = embed_batches([r["content"] for r in new_rows], batch_size, concurrency)
+            for row, vector in zip(new_rows, vectors):
+                row["embedding"] = vector
+        if stale_ids:
+            db.execute(delete(PolicyVector).where(PolicyVector.id.in_(stale_ids)))
+        if new_rows:
+            copy_rows(db, new_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def seed_policies():
+    ingest(builtin_documents())
     print("Policies seeded successfully via Ollama.")
 
 if __name__ == "__main__":
-    init_db()
-    seed_policies()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="directory of policy documents (.md/.txt); defaults to the built-in samples")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first (deletes all data)")
+    parser.add_argument("--prune", action="store_true", help="remove chunks whose source is not part of this run")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.reset:
+        init_db()
+    else:
+        create_tables()
+    documents = load_documents(args.dir) if args.dir else builtin_documents()
+    ingest(documents, batch_size=args.batch_size, concurrency=args.concurrency, prune=args.prune)
+    print("Ingestion complete.")
@@ -0,0 +1,111 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from database import AsyncSessionLocal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")) # cosine similarity
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_VERSION_TTL = float(os.getenv("SEMANTIC_CACHE_VERSION_TTL", "30"))
+
+# Only generic policy questions are cached. Anything personal ("my cheque", "suggest a card for me")
+# or account-specific must always go through the agent.
+POLICY_TERMS = re.compile(r"\b(policy|policies|clearing|clear|ach|cheques?|checks?|wire|fees?|hold|business days?)\b")
+PERSONAL_TERMS = re.compile(r"\b(i|i'm|me|my|mine|our|suggest\w*|recommend\w*|invest\w*|balance|account number)\b")
+
+def is_cacheable_query(query: str) -> bool:
+    lowered = query.lower()
+    return bool(POLICY_TERMS.search(lowered)) and not PERSONAL_TERMS.search(lowered)
+
+class SemanticCache:
+    """LRU + TTL cache of answers, matched by embedding similarity instead of exact text."""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl: float = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # id -> (unit vector, response, expires_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: str):
+        # Entries are only valid for the policy corpus they were answered from
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def lookup(self, vector: List[float], version: str) -> Optional[str]:
+        query = _unit(vector)
+        with self._lock:
+            self._check_version(version)
+            now = time.monotonic()
+            for key in [k for k, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+                self.evictions += 1
+            if self._entries:
+                keys = list(self._entries.keys())
+                matrix = np.stack([self._entries[k][0] for k in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def store(self, vector: List[float], version: str, response: str):
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_id] = (_unit(vector), response, time.monotonic() + self.ttl)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "corpus_version": self.version,
+            }
+
+def _unit(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+_corpus_version = None
+_corpus_checked_at = 0.0
+
+async def policy_corpus_version() -> str:
+    """Fingerprint of policy_vectors content; reseeding changes it and invalidates cached answers."""
+    global _corpus_version, _corpus_checked_at
+    if _corpus_version is None or time.monotonic() - _corpus_checked_at > SEMANTIC_CACHE_VERSION_TTL:
+        async with AsyncSessionLocal() as db:
+            fingerprint = (await db.execute(text(
+                "SELECT md5(coalesce(string_agg(content_hash || ':' || coalesce(embedding_fingerprint, ''), ',' ORDER BY content_hash), '')) FROM policy_vectors"
+            ))).scalar()
+        _corpus_version = fingerprint
+        _corpus_checked_at = time.monotonic()
+    return _corpus_version
+
+advisory_cache = SemanticCache()
@@ -0,0 +1,147 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict
+import numpy as np
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
+from executors import stt_executor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+# Model replicas that decode in parallel (CTranslate2 inter-op workers sharing one copy of the weights).
+# One per STT executor thread, so every thread that picks up a job has a replica free
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", str(stt_executor.max_workers)))
+# Intra-op threads per replica: split the cores between replicas instead of oversubscribing them
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", str(max(1, (os.cpu_count() or 1) // WHISPER_NUM_WORKERS))))
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+# Silero VAD drops silence before decoding (less audio to decode, fewer hallucinations on pauses)
+WHISPER_VAD_FILTER = os.getenv("WHISPER_VAD_FILTER", "true").lower() == "true"
+# > 0: long uploads are cut at VAD pauses and their chunks decoded as one batch (BatchedInferencePipeline)
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "0"))
+WHISPER_WARMUP = os.getenv("WHISPER_WARMUP", "true").lower() == "true"
+SAMPLE_RATE = 16000
+
+@dataclass
+class Transcription:
+    text: str
+    audio_seconds: float       # length of the input
+    speech_seconds: float      # what was left to decode after VAD
+    processing_seconds: float
+
+    @property
+    def rtf(self) -> float:
+        # Real-time factor: processing time per second of audio (< 1 is faster than real time)
+        return self.processing_seconds / self.audio_seconds if self.audio_seconds else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "audio_seconds": round(self.audio_seconds, 2),
+            "speech_seconds": round(self.speech_seconds, 2),
+            "processing_seconds": round(self.processing_seconds, 3),
+            "rtf": round(self.rtf, 3),
+        }
+
+class SpeechToText:
+    """
+    Whisper transcription for the voice endpoints. Calls are blocking and meant for the STT executor;
+    up to WHISPER_NUM_WORKERS of them decode concurrently on one loaded model.
+    """
+
+    def __init__(self):
+        self._model = None
+        self._pipeline = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.processing_seconds = 0.0
+
+    @property
+    def model(self) -> WhisperModel:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    self._model = WhisperModel(
+                        WHISPER_MODEL,
+                        device=WHISPER_DEVICE,
+                        compute_type=WHISPER_COMPUTE_TYPE,
+                        cpu_threads=WHISPER_CPU_THREADS,
+                        num_workers=WHISPER_NUM_WORKERS,
+                    )
+                    if WHISPER_BATCH_SIZE > 0:
+                        self._pipeline = BatchedInferencePipeline(model=self._model)
+                    print(f"Whisper '{WHISPER_MODEL}' loaded in {time.perf_counter() - started:.1f}s "
+                          f"({WHISPER_NUM_WORKERS} workers x {WHISPER_CPU_THREADS} threads, {WHISPER_COMPUTE_TYPE})")
+        return self._model
+
+    def transcribe(self, audio) -> Transcription:
+        # audio is a 16 kHz float32 array.
+        # segments is a lazy generator: decoding happens while iterating, so keep both in the worker thread
+        model = self.model
+        started = time.perf_counter()
+        if self._pipeline is not None:
+            segments, info = self._pipeline.transcribe(audio, beam_size=WHISPER_BEAM_SIZE, vad_filter=WHISPER_VAD_FILTER, batch_size=WHISPER_BATCH_SIZE)
+        else:
+            segments, info = model.transcribe(audio, beam_size=WHISPER_BEAM_SIZE, vad_filter=WHISPER_VAD_FILTER)
+        text = " ".join([segment.text for segment in segments])
+        result = Transcription(
+            text=text,
+            audio_seconds=info.duration,
+            speech_seconds=info.duration_after_vad if WHISPER_VAD_FILTER else info.duration,
+            processing_seconds=time.perf_counter() - started,
+        )
+        with self._stats_lock:
+            self.requests += 1
+            self.audio_seconds += result.audio_seconds
+            self.speech_seconds += result.speech_seconds
+            self.processing_seconds += result.processing_seconds
+        print(f"STT: {result.audio_seconds:.1f}s audio ({result.speech_seconds:.1f}s speech) in {result.processing_seconds:.2f}s, RTF {result.rtf:.2f}")
+        return result
+
+    def transcribe_bytes(self, content: bytes) -> Transcription:
+        # Decode the uploaded container (wav/webm/...) straight from memory to a 16 kHz float32 array
+        return self.transcribe(decode_audio(io.BytesIO(content), sampling_rate=SAMPLE_RATE))
+
+    def warm_up(self):
+        """
+        Loads the model and runs one decode on every replica at once, so the first requests don't pay
+        for allocation and kernel setup.
+        """
+        started = time.perf_counter()
+        self.model
+        # Low noise rather than silence: VAD would skip silence and nothing would be decoded
+        noise = np.random.default_rng(0).normal(0, 0.01, SAMPLE_RATE).astype(np.float32)
+
+        def decode(_):
+            segments, _info = self.model.transcribe(noise, beam_size=WHISPER_BEAM_SIZE, vad_filter=False)
+            return list(segments)
+
+        with ThreadPoolExecutor(max_workers=WHISPER_NUM_WORKERS) as pool:
+            list(pool.map(decode, range(WHISPER_NUM_WORKERS)))
+        print(f"Whisper warm-up done in {time.perf_counter() - started:.2f}s")
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "model": WHISPER_MODEL,
+                "loaded": self._model is not None,
+                "workers": WHISPER_NUM_WORKERS,
+                "cpu_threads": WHISPER_CPU_THREADS,
+                "batch_size": WHISPER_BATCH_SIZE,
+                "requests": self.requests,
+                "audio_seconds": round(self.audio_seconds, 2),
+                "speech_seconds": round(self.speech_seconds, 2),
+                "processing_seconds": round(self.processing_seconds, 2),
+                "rtf": round(self.processing_seconds / self.audio_seconds, 3) if self.audio_seconds else 0.0,
+            }
+
+stt = SpeechToText()
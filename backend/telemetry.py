@@ -0,0 +1,164 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Server-Timing header on every response (otherwise only when the request sends "X-Trace: 1")
+TRACE_HEADERS = os.getenv("TRACE_HEADERS", "false").lower() == "true"
+METRICS_NAMESPACE = "iva"
+# Set (by the deployment) when running several worker processes; must exist before this module is imported
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Sub-millisecond router decisions up to multi-second LLM calls
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Time spent in each stage of a request", ["stage"],
+    namespace=METRICS_NAMESPACE, buckets=STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter("stage_errors_total", "Stages that raised", ["stage"], namespace=METRICS_NAMESPACE)
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "HTTP request latency until the response headers", ["method", "route", "status"],
+    namespace=METRICS_NAMESPACE, buckets=STAGE_BUCKETS,
+)
+
+# Stages recorded during the current request: [(stage, seconds)], set by the middleware
+_trace: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("telemetry_trace", default=None)
+
+def record(name: str, seconds: float, failed: bool = False):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    if failed:
+        STAGE_ERRORS.labels(name).inc()
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+@contextmanager
+def stage(name: str):
+    """Times a block as one stage (works around awaits: `with stage("stt"): await ...`)."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record(name, time.perf_counter() - started, failed)
+
+@contextmanager
+def trace_scope():
+    trace = []
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+def server_timing(trace: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing header value; repeated stages (several LLM calls) are summed with their count."""
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in trace:
+        entry = totals.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f'{name.replace(":", "_")};dur={seconds * 1000:.1f}' + (f';desc="{count}x"' if count > 1 else "")
+        for name, (seconds, count) in totals.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class TelemetryCallback(BaseCallbackHandler):
+    """Times every LLM and tool call inside a LangGraph run as `llm` and `tool:<name>` stages."""
+    # Inline so the handler sees the request's trace context (and costs no thread hop)
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[UUID, Tuple[str, float]] = {}
+
+    def _start(self, run_id: UUID, name: str):
+        self._started[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id: UUID, failed: bool = False):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            record(started[0], time.perf_counter() - started[1], failed)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id, failed=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        self._start(run_id, f"tool:{(serialized or {}).get('name') or kwargs.get('name') or 'unknown'}")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id, failed=True)
+
+telemetry_callback = TelemetryCallback()
+
+class StatsCollector:
+    """Exposes the numeric fields of existing stats() dicts as gauges, read at scrape time."""
+
+    def __init__(self):
+        self._sources: List[Tuple[str, str, Callable]] = []
+
+    def register(self, name: str, stats: Callable, label: str = "name"):
+        """stats() returns {field: number} or {label_value: {field: number}} (e.g. one entry per executor)."""
+        self._sources.append((name, label, stats))
+
+    def collect(self):
+        for name, label, stats in self._sources:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Metrics source {name} failed: {e}")
+                continue
+            if isinstance(values, list):
+                values = {str(i): v for i, v in enumerate(values)}
+            nested = values and all(isinstance(v, dict) for v in values.values())
+            rows = values.items() if nested else [(None, values)]
+            families = {}
+            for label_value, fields in rows:
+                for field, value in fields.items():
+                    if not isinstance(value, (int, float)):
+                        continue
+                    family = families.get(field)
+                    if family is None:
+                        family = families[field] = GaugeMetricFamily(
+                            f"{METRICS_NAMESPACE}_{name}_{field}", f"{name} {field}", labels=[label] if nested else [],
+                        )
+                    family.add_metric([str(label_value)] if nested else [], float(value))
+            yield from families.values()
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+def metrics_response() -> Tuple[bytes, str]:
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    # Several workers (gunicorn.conf.py): histograms and counters summed over all of them,
+    # the stats gauges are those of the worker that answers the scrape
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+from sqlalchemy import select, update, delete, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from database import AsyncSessionLocal, Account, Transaction, IdempotencyKey
+from user_cache import user_cache
+from fraud import fraud_engine, epoch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CENT = Decimal("0.01")
+# A retry with the same key after this long posts again; older keys are purged in the background,
+# at most every IDEMPOTENCY_PURGE_INTERVAL seconds per process, IDEMPOTENCY_PURGE_BATCH rows per transaction
+IDEMPOTENCY_KEY_RETENTION_HOURS = float(os.getenv("IDEMPOTENCY_KEY_RETENTION_HOURS", "24"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "60"))
+IDEMPOTENCY_PURGE_BATCH = int(os.getenv("IDEMPOTENCY_PURGE_BATCH", "1000"))
+
+class TransferError(Exception):
+    """A transfer request that can never succeed as given (bad amount, same account, ...)."""
+
+def to_money(amount) -> Decimal:
+    try:
+        value = Decimal(str(amount))
+    except (InvalidOperation, ValueError):
+        raise TransferError(f"Invalid amount: {amount}")
+    if not value.is_finite() or value <= 0:
+        raise TransferError("Amount must be a positive number.")
+    if value != value.quantize(CENT):
+        raise TransferError("Amount can have at most 2 decimal places.")
+    return value.quantize(CENT)
+
+def request_fingerprint(from_account: str, to_account: str, amount: Decimal, description: str) -> str:
+    return hashlib.sha256(json.dumps([from_account, to_account, str(amount), description]).encode()).hexdigest()
+
+async def transfer_funds(from_account: str, to_account: str, amount, description: str = "Transfer", idempotency_key: Optional[str] = None,
+                         customer_id: Optional[int] = None) -> str:
+    """
+    Moves money between two accounts in one transaction.
+    - With a customer_id (always, from the MCP tool), from_account must belong to that customer
+    - Both rows are locked with SELECT ... FOR UPDATE in primary-key order, so concurrent transfers
+      serialize per account and can't deadlock or overdraw
+    - With an idempotency key, the first request's response is stored in the same transaction and
+      a replay (e.g. a retried tool call) within IDEMPOTENCY_KEY_RETENTION_HOURS returns it without posting again
+    - The debit is scored by the in-memory fraud engine (no extra queries) and fed back to it on commit
+    """
+    try:
+        value = to_money(amount)
+        if from_account == to_account:
+            raise TransferError("Cannot transfer to the same account.")
+    except TransferError as e:
+        return f"Error: {e}"
+    fingerprint = request_fingerprint(from_account, to_account, value, description)
+    await fraud_engine.ensure_ready()
+
+    async with AsyncSessionLocal() as db:
+        try:
+            if idempotency_key:
+                # Blocks while another transaction holds the same key, then sees its committed row
+                claimed = (await db.execute(
+                    insert(IdempotencyKey)
+                    .values(key=idempotency_key, request_hash=fingerprint)
+                    .on_conflict_do_nothing(index_elements=["key"])
+                    .returning(IdempotencyKey.key)
+                )).first()
+                if claimed is None:
+                    previous = (await db.execute(
+                        select(IdempotencyKey.request_hash, IdempotencyKey.response).where(IdempotencyKey.key == idempotency_key)
+                    )).first()
+                    await db.rollback()
+                    if previous.request_hash != fingerprint:
+                        return "Error: This idempotency key was already used for a different transfer."
+                    return previous.response
+
+            response, debit = await _post_transfer(db, from_account, to_account, value, description, customer_id)
+            if idempotency_key:
+                await db.execute(update(IdempotencyKey).where(IdempotencyKey.key == idempotency_key).values(response=response))
+            await db.commit()
+            if debit:
+                fraud_engine.observe(*debit)
+            if idempotency_key:
+                schedule_idempotency_purge()
+            return response
+        except Exception as e:
+            await db.rollback()
+            return f"Error: {str(e)}"
+
+_purged_at = 0.0
+_purge_task = None
+
+def schedule_idempotency_purge():
+    """Starts a background purge unless one ran recently; the transfer never waits for it."""
+    global _purged_at, _purge_task
+    if (_purge_task is not None and not _purge_task.done()) or time.monotonic() - _purged_at < IDEMPOTENCY_PURGE_INTERVAL:
+        return
+    _purged_at = time.monotonic()
+    _purge_task = asyncio.create_task(purge_idempotency_keys())
+
+async def purge_idempotency_keys(batch: int = IDEMPOTENCY_PURGE_BATCH):
+    """Deletes expired keys in short transactions of at most `batch` rows; rows another purge holds are skipped."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=IDEMPOTENCY_KEY_RETENTION_HOURS)
+    try:
+        while True:
+            async with AsyncSessionLocal() as db:
+                expired = (
+                    select(IdempotencyKey.key).where(IdempotencyKey.created_at < cutoff)
+                    .limit(batch).with_for_update(skip_locked=True)
+                )
+                deleted = (await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired)))).rowcount
+                await db.commit()
+            if deleted < batch:
+                return
+    except Exception as e:
+        print(f"Idempotency key purge failed: {e}", file=sys.stderr)
+
+async def _post_transfer(db, from_account: str, to_account: str, amount: Decimal, description: str, customer_id: Optional[int]):
+    """Returns (response, debit event for the fraud engine or None)."""
+    # Another customer's debit account is never selected (nor locked): it looks the same as an unknown one
+    sender_matches = Account.account_number == from_account
+    if customer_id is not None:
+        sender_matches = and_(sender_matches, Account.customer_id == customer_id)
+    accounts = (await db.execute(
+        select(Account)
+        .where(or_(sender_matches, Account.account_number == to_account))
+        .order_by(Account.id)
+        .with_for_update()
+    )).scalars().all()
+    by_number = {a.account_number: a for a in accounts}
+    sender, receiver = by_number.get(from_account), by_number.get(to_account)
+
+    if not sender or not receiver:
+        return "Error: One or both accounts not found.", None
+
+    if sender.balance < amount:
+        return "Error: Insufficient funds.", None
+
+    now = datetime.datetime.utcnow()
+    assessment = fraud_engine.score(sender.id, float(amount), to_account, epoch(now))
+
+    sender.balance -= amount
+    receiver.balance += amount
+
+    # Record transactions
+    debit = Transaction(account_id=sender.id, amount=-amount, transaction_type="Debit", description=description,
+                        counterparty_account=to_account, is_fraudulent=assessment.flagged, created_at=now)
+    db.add(debit)
+    db.add(Transaction(account_id=receiver.id, amount=amount, transaction_type="Credit", description=description,
+                       counterparty_account=from_account, created_at=now))
+    await db.flush()
+    await fraud_engine.publish(db, debit)
+
+    await user_cache.invalidate(db, customer_id=sender.customer_id)
+    if receiver.customer_id != sender.customer_id:
+        await user_cache.invalidate(db, customer_id=receiver.customer_id)
+
+    response = f"Successfully transferred ${amount} from {from_account} to {to_account}."
+    if assessment.flagged:
+        # Mock alert for buildathon, as in validate_transaction_fraud
+        print(f"MOCK EMAIL: transfer of ${amount} from {from_account} flagged for review ({'; '.join(assessment.reasons)})", file=sys.stderr)
+        response += " The transfer was flagged for review and a confirmation email was sent to the customer."
+    return response, (sender.id, float(amount), to_account, epoch(now))
@@ -0,0 +1,186 @@
+import asyncio
+import io
+import os
+import threading
+import wave
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import edge_tts
+import numpy as np
+from voice_stream import SentenceChunker
+from telemetry import stage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TTS_BACKEND = os.getenv("TTS_BACKEND", "edge")  # edge | local
+TTS_VOICE = os.getenv("TTS_VOICE", "en-US-AvaNeural")
+# Sentences synthesized at once across all requests (each is one connection to the edge-tts service)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "8"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Simulated synthesis time of the local backend, per character
+TTS_LOCAL_MS_PER_CHAR = float(os.getenv("TTS_LOCAL_MS_PER_CHAR", "0"))
+
+def split_sentences(text: str) -> List[str]:
+    """Same boundaries as the streaming path, so both share cache entries."""
+    chunker = SentenceChunker()
+    sentences = chunker.feed(text)
+    rest = chunker.flush()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+class EdgeBackend:
+    """Microsoft Edge online TTS (MP3). MP3 frames can be concatenated, so sentences join into one file."""
+    name = "edge"
+    media_type = "audio/mpeg"
+
+    async def synthesize(self, sentence: str, voice: str) -> bytes:
+        chunks = []
+        async for chunk in edge_tts.Communicate(sentence, voice).stream():
+            if chunk["type"] == "audio":
+                chunks.append(chunk["data"])
+        return b"".join(chunks)
+
+    def join(self, parts: List[bytes]) -> bytes:
+        return b"".join(parts)
+
+class LocalBackend:
+    """
+    Offline stand-in for tests and load tests: a short tone per sentence as 16 kHz mono WAV,
+    with an optional simulated latency (TTS_LOCAL_MS_PER_CHAR).
+    """
+    name = "local"
+    media_type = "audio/wav"
+    sample_rate = 16000
+
+    async def synthesize(self, sentence: str, voice: str) -> bytes:
+        if TTS_LOCAL_MS_PER_CHAR:
+            await asyncio.sleep(len(sentence) * TTS_LOCAL_MS_PER_CHAR / 1000)
+        # ~60 ms of audio per character, like speech
+        samples = int(self.sample_rate * 0.06 * len(sentence))
+        pitch = 220 + (sum(map(ord, voice)) % 220)
+        pcm = (3000 * np.sin(2 * np.pi * pitch * np.arange(samples) / self.sample_rate)).astype("<i2").tobytes()
+        return self._wav([pcm])
+
+    def join(self, parts: List[bytes]) -> bytes:
+        # One header for the whole reply: strip each part's header and concatenate the samples
+        frames = []
+        for part in parts:
+            with wave.open(io.BytesIO(part)) as w:
+                frames.append(w.readframes(w.getnframes()))
+        return self._wav(frames)
+
+    def _wav(self, frames: List[bytes]) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(b"".join(frames))
+        return buffer.getvalue()
+
+BACKENDS = {"edge": EdgeBackend, "local": LocalBackend}
+
+class PhraseCache:
+    """LRU of synthesized sentences, bounded by total audio bytes."""
+
+    def __init__(self, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()  # (backend, voice, sentence) -> audio
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            audio = self._items.get(key)
+            if audio is not None:
+                self._items.move_to_end(key)
+            return audio
+
+    def set(self, key, audio: bytes):
+        if len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = audio
+            self.size += len(audio)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+class TextToSpeech:
+    """
+    Sentence-level synthesis: a reply is split into sentences that are synthesized in parallel
+    (bounded by TTS_CONCURRENCY), and each (voice, sentence) is synthesized once per process.
+    Concurrent requests for the same sentence share one synthesis.
+    """
+
+    def __init__(self, backend: str = TTS_BACKEND):
+        self.backend = BACKENDS[backend]()
+        self.cache = PhraseCache()
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self._semaphore = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def media_type(self) -> str:
+        return self.backend.media_type
+
+    async def sentence(self, sentence: str, voice: str = TTS_VOICE) -> bytes:
+        key = (self.backend.name, voice, " ".join(sentence.split()))
+        audio = self.cache.get(key)
+        if audio is not None:
+            self.hits += 1
+            return audio
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._synthesize(key, voice))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # shield: a cancelled caller (e.g. a closed voice socket) must not cancel what other callers wait on
+        return await asyncio.shield(task)
+
+    async def _synthesize(self, key, voice: str) -> bytes:
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+            async with self._semaphore:
+                with stage("tts_synthesis"):
+                    audio = await self.backend.synthesize(key[2], voice)
+            self.cache.set(key, audio)
+            return audio
+        finally:
+            del self._inflight[key]
+
+    async def synthesize(self, text: str, voice: str = TTS_VOICE) -> bytes:
+        """Whole reply as one audio file; takes about as long as its slowest sentence."""
+        sentences = split_sentences(text)
+        if not sentences:
+            return b""
+        parts = await asyncio.gather(*(self.sentence(s, voice) for s in sentences))
+        return self.backend.join(list(parts))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.cache),
+            "bytes": self.cache.size,
+            "max_bytes": self.cache.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+tts = TextToSpeech()
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from sqlalchemy import select
+from database import AsyncSessionLocal, Customer, Account
+from notifications import hub, notify
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Short TTL: the cache absorbs the repeated point queries of one chat turn; writes invalidate it explicitly
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# Postgres channel used to invalidate the caches of every process (API and each MCP worker)
+INVALIDATION_CHANNEL = "user_cache_invalidation"
+
+@dataclass(frozen=True)
+class CustomerSnapshot:
+    id: int
+    full_name: Optional[str]
+    email: Optional[str]
+    address: Optional[str]
+    is_authenticated: bool
+
+    @classmethod
+    def from_row(cls, customer: Customer) -> "CustomerSnapshot":
+        return cls(customer.id, customer.full_name, customer.email, customer.address, bool(customer.is_authenticated))
+
+    def as_customer_info(self) -> Dict:
+        # What the agents (and through them, the tools) get to know about the caller
+        return {"id": self.id, "name": self.full_name, "email": self.email}
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k, (v, _) in self._items.items() if predicate(v)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+class UserCache:
+    """
+    Customer and account snapshots, cached per process for USER_CACHE_TTL seconds.
+    Writers call invalidate() inside their transaction; the NOTIFY is delivered on commit,
+    so every process drops its copy as soon as the write is visible.
+    """
+
+    def __init__(self):
+        self.customers = TTLCache()  # email -> CustomerSnapshot
+        self.accounts = TTLCache()   # customer_id -> list of account dicts
+        self.hits = 0
+        self.misses = 0
+        # Invalidations may be missed while the listener is down: start over cold
+        hub.subscribe(INVALIDATION_CHANNEL, self._on_invalidation, on_reset=self.clear)
+
+    async def get_customer(self, email: str) -> Optional[CustomerSnapshot]:
+        return await self._cached(self.customers, email, self._load_customer)
+
+    async def get_accounts(self, customer_id: int) -> List[Dict]:
+        return await self._cached(self.accounts, customer_id, self._load_accounts)
+
+    async def _cached(self, cache: TTLCache, key, load):
+        await hub.start()
+        value = cache.get(key)
+        if value is None:
+            self.misses += 1
+            value = await load(key)
+            if value is not None:
+                cache.set(key, value)
+        else:
+            self.hits += 1
+        return value
+
+    async def _load_customer(self, email: str) -> Optional[CustomerSnapshot]:
+        async with AsyncSessionLocal() as db:
+            customer = (await db.execute(select(Customer).where(Customer.email == email))).scalars().first()
+        return CustomerSnapshot.from_row(customer) if customer else None
+
+    async def _load_accounts(self, customer_id: int) -> List[Dict]:
+        async with AsyncSessionLocal() as db:
+            accounts = (await db.execute(select(Account).where(Account.customer_id == customer_id))).scalars().all()
+        return [{"account_number": acc.account_number, "type": acc.account_type, "balance": float(acc.balance or 0)} for acc in accounts]
+
+    def drop(self, customer_id: Optional[int] = None, email: Optional[str] = None):
+        """Drops cached data for one customer in this process only."""
+        if email:
+            self.customers.discard(email)
+        if customer_id is not None:
+            self.customers.discard_where(lambda c: c.id == customer_id)
+            self.accounts.discard(customer_id)
+
+    async def invalidate(self, db, customer_id: Optional[int] = None, email: Optional[str] = None):
+        """Call from a write transaction: drops the local copy now and every other process's copy on commit."""
+        self.drop(customer_id, email)
+        await notify(db, INVALIDATION_CHANNEL, {"customer_id": customer_id, "email": email})
+
+    def _on_invalidation(self, data: Dict):
+        self.drop(data.get("customer_id"), data.get("email"))
+
+    def clear(self):
+        self.customers.clear()
+        self.accounts.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "customers": len(self.customers),
+            "accounts": len(self.accounts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "listening": hub.listening,
+        }
+
+user_cache = UserCache()
@@ -0,0 +1,98 @@
+import os
+import re
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from typing import List, Optional
+
+# Streaming voice helpers for /ws/voice
+# Audio in: raw PCM16 little-endian, mono, 16 kHz (the format Whisper expects, so no resampling on the server)
+SAMPLE_RATE = 16000
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+VAD_CHECK_INTERVAL_MS = int(os.getenv("VAD_CHECK_INTERVAL_MS", "500"))
+VAD_MAX_SEGMENT_S = float(os.getenv("VAD_MAX_SEGMENT_S", "15"))
+
+class SpeechSegmenter:
+    """Buffers incoming audio frames and cuts them into speech segments at VAD-detected pauses.
+
+    Each closed segment can be transcribed while the user is still talking, so only the last
+    segment is left to transcribe once the utterance ends.
+    """
+
+    def __init__(self):
+        self.vad_options = VadOptions(
+            min_silence_duration_ms=VAD_MIN_SILENCE_MS,
+            max_speech_duration_s=VAD_MAX_SEGMENT_S,
+            speech_pad_ms=100,
+        )
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self._frames: List[bytes] = []  # raw frames not yet added to buffer
+        self._unchecked = 0
+        self._check_samples = SAMPLE_RATE * VAD_CHECK_INTERVAL_MS // 1000
+        self._silence_samples = SAMPLE_RATE * VAD_MIN_SILENCE_MS // 1000
+
+    def append(self, pcm16: bytes) -> bool:
+        """Buffers a frame (cheap enough for the event loop); True once VAD_CHECK_INTERVAL_MS of new audio is due a check."""
+        self._frames.append(pcm16)
+        self._unchecked += len(pcm16) // 2
+        return self._unchecked >= self._check_samples
+
+    def _consolidate(self):
+        if self._frames:
+            pcm16, self._frames = b"".join(self._frames), []
+            samples = np.frombuffer(pcm16[:len(pcm16) // 2 * 2], dtype=np.int16).astype(np.float32) / 32768.0
+            self.buffer = np.concatenate([self.buffer, samples])
+
+    def segments(self) -> List[np.ndarray]:
+        """Runs VAD over the buffered audio and returns the speech segments now followed by enough silence."""
+        self._consolidate()
+        self._unchecked = 0
+        speech = get_speech_timestamps(self.buffer, self.vad_options, sampling_rate=SAMPLE_RATE)
+        if not speech:
+            # Only silence so far: keep a short tail so the start of the next word is not clipped
+            self.buffer = self.buffer[-self._silence_samples:]
+            return []
+
+        closed = [s for s in speech if s["end"] <= len(self.buffer) - self._silence_samples]
+        if not closed:
+            return []
+        segments = [self.buffer[s["start"]:s["end"]] for s in closed]
+        self.buffer = self.buffer[closed[-1]["end"]:]
+        return segments
+
+    def flush(self) -> Optional[np.ndarray]:
+        """Returns the remaining speech (if any) at the end of an utterance and resets the buffer."""
+        self._consolidate()
+        buffer, self.buffer, self._unchecked = self.buffer, np.zeros(0, dtype=np.float32), 0
+        if not len(buffer):
+            return None
+        speech = get_speech_timestamps(buffer, self.vad_options, sampling_rate=SAMPLE_RATE)
+        if not speech:
+            return None
+        return np.concatenate([buffer[s["start"]:s["end"]] for s in speech])
+
+# Sentence boundary: terminal punctuation followed by whitespace, or a line break
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+MIN_SENTENCE_CHARS = 12
+
+class SentenceChunker:
+    """Turns a stream of LLM tokens into sentence-sized chunks for TTS."""
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, token: str) -> List[str]:
+        self.pending += token
+        sentences = []
+        cut = 0
+        for match in SENTENCE_END.finditer(self.pending):
+            sentence = self.pending[cut:match.start()].strip()
+            # Very short fragments ("Hi.", "1.") are merged into the following sentence
+            if len(sentence) >= MIN_SENTENCE_CHARS:
+                sentences.append(sentence)
+                cut = match.end()
+        self.pending = self.pending[cut:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        sentence, self.pending = self.pending.strip(), ""
+        return sentence or None
@@ -53,6 +53,18 @@ function App() {
     setLoading(false);
   };
 
+  const handleLogout = async () => {
+    // Revoke the token server-side; log out locally even if the server can't be reached
+    try {
+      await fetch('http://localhost:8000/logout', {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${user.token}` }
+      });
+    } catch (err) {}
+    setUser(null);
+    setView('login');
+  };
+
   const handleRegister = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -122,8 +134,8 @@ function App() {
         { role: 'ai', text: data.response_text }
       ]);
 
-      if (data.audio_url) {
-        const audio = new Audio(`http://localhost:8000${data.audio_url}`);
+      if (data.audio) {
+        const audio = new Audio(`data:${data.media_type};base64,${data.audio}`);
         audio.play().catch(e => console.error("Audio play failed"));
       }
     } catch (error) {
@@ -173,7 +185,7 @@ function App() {
     <div className="app-container">
       <header>
         <h1>🤖 IVA - {user.name}</h1>
-        <button className="logout-btn" onClick={() => { setUser(null); setView('login'); }}>Logout</button>
+        <button className="logout-btn" onClick={handleLogout}>Logout</button>
       </header>
 
       <main className="chat-history">